@@ -0,0 +1,74 @@
+# admission.py
+import asyncio
+from contextlib import asynccontextmanager
+from app.deadline import remaining
+from app.config import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUED,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_RETRY_AFTER_SECONDS,
+)
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control; retry after retry_after seconds."""
+
+    def __init__(self, retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        super().__init__("Server is at capacity, retry later")
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    Bounded concurrency in front of the expensive endpoints: at most
+    max_in_flight requests run, at most max_queued wait (no longer than
+    queue_timeout, or the request's deadline) for a slot, and anything
+    beyond that is rejected at once instead of piling up behind a slow
+    Grafana.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        max_queued: int = ADMISSION_MAX_QUEUED,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the enclosed work; raises Overloaded when none frees up in time."""
+        if self.in_flight + self.queued >= self.max_in_flight + self.max_queued:
+            self.rejected += 1
+            raise Overloaded()
+
+        if self._slots.locked():
+            left = remaining()
+            wait = self.queue_timeout if left is None else max(0.0, min(self.queue_timeout, left))
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded()
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()  # free slot: returns without suspending
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+
+# Shared by /nl-query, /nl-query/batch, /nl-query/stream, /export and cursor pages
+admission = AdmissionControl()
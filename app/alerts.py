@@ -0,0 +1,297 @@
+# alerts.py
+import asyncio
+import datetime
+import logging
+import time
+import numpy as np
+from app.flux_builder import build_raw_flux, split_topics
+from app.data_parser import extract_series
+from app.grafana import query_grafana_batch, result_error
+from app.fleet import fleet_registry, last_seen_iso
+from app.topics import topic_registry
+from app.series import STATUS_MEASUREMENTS
+from app.sensor import SENSOR_CONFIG
+from app.config import (
+    ALERT_POLL_SECONDS,
+    ALERT_LOOKBACK_SECONDS,
+    ALERT_CONSTANT_READINGS,
+    ALERT_QUEUE_SIZE,
+    ALERT_HEARTBEAT_SECONDS,
+)
+
+# alert kind -> (check it belongs to, whether it raises (True) or clears that check)
+ALERT_KINDS = {
+    "out_of_range": ("range", True),
+    "back_in_range": ("range", False),
+    "constant": ("constant", True),
+    "varying": ("constant", False),
+    "offline": ("status", True),
+    "online": ("status", False),
+}
+
+
+def parse_alert_fields(value: str = None):
+    """"temperature,humidity" -> {"temperature", "humidity"}; None / "" -> None (every field)."""
+    if not value:
+        return None
+    fields = {f.strip() for f in value.split(",") if f.strip()}
+    unknown = fields - set(SENSOR_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return fields
+
+
+def alert_message(kind: str, field: str, topic: str, value: float, run: int = 0) -> str:
+    """Text of a numeric-topic alert (range and constant checks)."""
+    cfg = SENSOR_CONFIG[field]
+    unit = cfg.get("unit", "")
+    expected = cfg.get("reasoning", {}).get("expected_range")
+    if kind == "out_of_range":
+        return f"{topic}: {field} {value:.2f}{unit} is outside the expected range ({expected[0]}–{expected[1]})."
+    if kind == "back_in_range":
+        return f"{topic}: {field} {value:.2f}{unit} is back within the expected range ({expected[0]}–{expected[1]})."
+    if kind == "constant":
+        return f"{topic}: {field} has read {value:.2f}{unit} for {run} readings in a row; may indicate a malfunction."
+    return f"{topic}: {field} readings are changing again ({value:.2f}{unit})."
+
+
+class TopicCheck:
+    """
+    Incremental expected_range / check_constant state of one numeric topic.
+    Only readings newer than the watermark are looked at, and each check
+    alerts when its state flips rather than on every reading.
+    """
+
+    __slots__ = ("field", "topic", "watermark", "outside", "constant", "last_value", "run")
+
+    def __init__(self, field: str, topic: str):
+        self.field = field
+        self.topic = topic
+        self.watermark = None  # epoch ms of the newest reading seen
+        self.outside = False
+        self.constant = False
+        self.last_value = None
+        self.run = 0  # identical readings at the end of the data seen so far
+
+    def alert(self, kind: str, value: float, at: int) -> dict:
+        return {
+            "type": "alert",
+            "alert": kind,
+            "field": self.field,
+            "topic": self.topic,
+            "value": float(value),
+            "time": last_seen_iso(at / 1000),
+            "message": alert_message(kind, self.field, self.topic, float(value), self.run),
+        }
+
+    def feed(self, series, constant_after: int = ALERT_CONSTANT_READINGS) -> list:
+        """Update the checks with a topic's new readings (sorted by time) -> alerts raised or cleared."""
+        if self.watermark is not None:
+            series = series.between(self.watermark, np.iinfo("int64").max)
+        if not len(series):
+            return []
+
+        reasoning = SENSOR_CONFIG[self.field].get("reasoning", {})
+        times, values = series.times, series.values
+        alerts = []
+
+        expected = reasoning.get("expected_range")
+        if expected:
+            outside = (values < expected[0]) | (values > expected[1])
+            if not self.outside and outside.any():
+                i = int(np.argmax(outside))
+                self.outside = True
+                alerts.append(self.alert("out_of_range", values[i], times[i]))
+            if self.outside and not outside[-1]:
+                self.outside = False
+                alerts.append(self.alert("back_in_range", values[-1], times[-1]))
+
+        if reasoning.get("check_constant"):
+            last = values[-1]
+            changed = np.flatnonzero(values != last)
+            if changed.size:
+                self.run = len(values) - 1 - int(changed[-1])
+            else:
+                self.run = (self.run if self.last_value == last else 0) + len(values)
+            constant = self.run >= constant_after
+            if constant != self.constant:
+                self.constant = constant
+                alerts.append(self.alert("constant" if constant else "varying", last, times[-1]))
+
+        self.last_value = float(values[-1])
+        self.watermark = int(times[-1])
+        return alerts
+
+
+class Subscription:
+    """One subscriber's bounded event queue; a subscriber that falls behind loses its oldest events."""
+
+    def __init__(self, fields=None, size: int = ALERT_QUEUE_SIZE):
+        self.fields = fields
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def wants(self, event: dict) -> bool:
+        return self.fields is None or "field" not in event or event["field"] in self.fields
+
+    def put(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float = ALERT_HEARTBEAT_SECONDS) -> dict:
+        """Next event, or a heartbeat when none arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return {"type": "heartbeat", "time": last_seen_iso(time.time())}
+
+
+class AlertMonitor:
+    """
+    One shared poller for every alert subscriber. Each ALERT_POLL_SECONDS it
+    fetches the raw readings of all numeric topics since their watermarks
+    in one batched Grafana request, updates the per-topic checks and
+    compares the last-seen registry for online / offline changes, then
+    pushes the resulting alerts to every subscriber. The poller only runs
+    while someone is subscribed; state is kept in between, so the next
+    subscriber resumes from the watermarks (at most ALERT_LOOKBACK_SECONDS back).
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.checks = {}  # topic -> TopicCheck
+        self.status = {}  # status topic -> "ONLINE" / "OFFLINE"
+        self.active = {}  # (topic, check) -> the alert currently raised
+        self.task = None
+        self.polls = 0
+        self.published = 0
+
+    def subscribe(self, client, fields=None) -> Subscription:
+        """New subscription, starting with a snapshot of the currently raised alerts."""
+        sub = Subscription(fields)
+        sub.put({"type": "snapshot", "alerts": [a for a in self.active.values() if sub.wants(a)]})
+        self.subscribers.add(sub)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(client))
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers.discard(sub)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def stop(self):
+        self.subscribers.clear()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def publish(self, events: list):
+        for event in events:
+            if event["type"] == "alert":
+                check, raised = ALERT_KINDS[event["alert"]]
+                if raised:
+                    self.active[(event["topic"], check)] = event
+                else:
+                    self.active.pop((event["topic"], check), None)
+                self.published += 1
+            for sub in self.subscribers:
+                if sub.wants(event):
+                    sub.put(event)
+
+    async def run(self, client):
+        while True:
+            try:
+                self.publish(await self.poll(client))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception("Alert poll failed")
+                self.publish([{"type": "error", "detail": str(e)}])
+            await asyncio.sleep(ALERT_POLL_SECONDS)
+
+    async def poll(self, client) -> list:
+        """One incremental pass over every topic -> alerts raised or cleared since the last pass."""
+        end = datetime.datetime.now(datetime.timezone.utc)
+        floor_ms = int((end.timestamp() - ALERT_LOOKBACK_SECONDS) * 1000)
+
+        fluxes = {}
+        refs = {}
+        for field, cfg in SENSOR_CONFIG.items():
+            topics = topic_registry.lookup(field)
+            if cfg["measurement"] in STATUS_MEASUREMENTS or not topics:
+                continue
+            refs[field] = []
+            for since_ms, group in self.watermark_groups(topics, floor_ms):
+                since = datetime.datetime.fromtimestamp(since_ms / 1000, datetime.timezone.utc)
+                for chunk in split_topics(group):
+                    ref_id = f"{field}/{len(refs[field])}"
+                    fluxes[ref_id] = build_raw_flux(since, end, chunk)
+                    refs[field].append(ref_id)
+
+        alerts = []
+        if fluxes:
+            resp = await query_grafana_batch(client, fluxes)
+            error = result_error(resp, list(fluxes))
+            if error:
+                raise RuntimeError(error)
+            for field, ref_ids in refs.items():
+                for s in extract_series(resp, field, ref_id=ref_ids):
+                    check = self.checks.get(s.topic) or self.checks.setdefault(s.topic, TopicCheck(field, s.topic))
+                    alerts.extend(check.feed(s))
+
+        await fleet_registry.refresh(client)
+        alerts.extend(self.status_alerts(fleet_registry.snapshot()))
+
+        self.polls += 1
+        return alerts
+
+    def watermark(self, topic: str, default: int) -> int:
+        check = self.checks.get(topic)
+        return default if check is None or check.watermark is None else check.watermark
+
+    def watermark_groups(self, topics, floor_ms: int, grain_ms: int = ALERT_POLL_SECONDS * 1000) -> list:
+        """
+        [(since_ms, topics)]: topics whose watermarks lie within grain_ms of
+        each other share one fetch from the oldest of them, so a silent or
+        offline topic (stuck at an old watermark or at floor_ms) is re-read
+        on its own instead of pinning the whole field's fetch back to it.
+        """
+        groups = []
+        for since_ms, t in sorted((max(floor_ms, self.watermark(t, floor_ms)), t) for t in topics):
+            if groups and since_ms - groups[-1][0] <= grain_ms:
+                groups[-1][1].append(t)
+            else:
+                groups.append((since_ms, [t]))
+        return [(since_ms, tuple(group)) for since_ms, group in groups]
+
+    def status_alerts(self, snapshot: list) -> list:
+        """Online / offline changes against the previous snapshot (sensors already offline at the first one too)."""
+        alerts = []
+        for s in snapshot:
+            previous = self.status.get(s["topic"])
+            self.status[s["topic"]] = s["status"]
+            if s["status"] == previous or (previous is None and s["status"] == "ONLINE"):
+                continue
+            kind = s["status"].lower()
+            alerts.append({
+                "type": "alert",
+                "alert": kind,
+                "field": "status",
+                "topic": s["topic"],
+                "value": s["status"],
+                "time": last_seen_iso(s["last_seen"]),
+                "message": f"{s['topic']} is {s['status']} (last seen {last_seen_iso(s['last_seen'])}).",
+            })
+        return alerts
+
+
+# Shared by every /alerts subscriber
+alert_monitor = AlertMonitor()
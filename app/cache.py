@@ -0,0 +1,183 @@
+# cache.py
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from app.series import concat_series
+from app.config import (
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL_SECONDS,
+    CACHE_EXTEND_TTL_SECONDS,
+    CACHE_CLOSED_TTL_SECONDS,
+)
+
+
+class TTLCache:
+    """Size-bounded LRU mapping with a per-entry time-to-live."""
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ---------------- Time-bucket alignment ----------------
+
+def epoch_seconds(dt: datetime.datetime) -> float:
+    """Epoch seconds; naive datetimes are UTC (see parse_nl_query)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def align_range(start, end, bucket_seconds: int):
+    """Snap start down and end up to bucket boundaries so nearby queries share a key."""
+    start = start - datetime.timedelta(seconds=epoch_seconds(start) % bucket_seconds)
+    rem = epoch_seconds(end) % bucket_seconds
+    if rem:
+        end = end + datetime.timedelta(seconds=bucket_seconds - rem)
+    return start.replace(microsecond=0), end.replace(microsecond=0)
+
+
+def utcnow_like(dt: datetime.datetime) -> datetime.datetime:
+    if dt.tzinfo is None:
+        return datetime.datetime.utcnow()
+    return datetime.datetime.now(dt.tzinfo)
+
+
+# ---------------- Range-aware series cache ----------------
+
+class RangeEntry:
+    """Cached series for one (topics, measurement, window) key over [start, end]."""
+
+    __slots__ = ("start", "end", "series", "fetched_at")
+
+    def __init__(self, start, end, series):
+        self.start = start
+        self.end = end
+        self.series = series
+        self.fetched_at = time.monotonic()
+
+    @property
+    def fresh(self):
+        return time.monotonic() - self.fetched_at < CACHE_TTL_SECONDS
+
+
+def slice_series(series, start, end):
+    start_ms, end_ms = int(epoch_seconds(start) * 1000), int(epoch_seconds(end) * 1000)
+    return [s.between(start_ms, end_ms) for s in series]
+
+
+class QueryCache:
+    """
+    Cache in front of the Grafana fetch.
+
+    - exact entries (stats-only plans, status last()) keyed by plan + aligned range
+    - closed range entries (windowed series whose aligned end is not after
+      now, e.g. "yesterday") keyed by plan + aligned range; immutable and kept
+      for CACHE_CLOSED_TTL_SECONDS
+    - one sliding range entry per plan key; a sliding range such as
+      "last 2 days" that moved forward is served by fetching just the new tail
+      since the cached end and merging it in.
+    """
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES):
+        self.entries = TTLCache(maxsize=maxsize)
+        self.tail_fetches = 0
+
+    @staticmethod
+    def is_closed(end) -> bool:
+        return end <= utcnow_like(end)
+
+    def ttl_for(self, end) -> float:
+        return CACHE_CLOSED_TTL_SECONDS if self.is_closed(end) else CACHE_TTL_SECONDS
+
+    # -------- exact entries --------
+
+    def get(self, key, start, end):
+        return self.entries.get((key, start, end))
+
+    def set(self, key, start, end, value):
+        self.entries.set((key, start, end), value, ttl=self.ttl_for(end))
+
+    # -------- range entries --------
+
+    def lookup_range(self, key, start, end, overlap: datetime.timedelta):
+        """
+        ("hit", series)        - cached data covers [start, end]
+        ("tail", (since, head)) - fetch (since, end] and call extend_range; head
+                                  is the cached [start, since) part, taken now
+                                  so a concurrent request replacing the entry
+                                  cannot narrow it
+        ("miss", None)         - fetch the whole range and call store_range
+        overlap: how much of a sliding entry's end to re-fetch, since its last
+        bucket was still filling when it was cached.
+        """
+        closed = self.entries.get(("closed", key, start, end))
+        if closed is not None:
+            return "hit", closed.series
+
+        entry = self.entries.get(key)
+        if entry is None or start < entry.start or entry.end < start:
+            return "miss", None
+        if end <= entry.end and entry.fresh:
+            return "hit", slice_series(entry.series, start, end)
+        since = max(entry.end - overlap, start)
+        return "tail", (since, slice_series(entry.series, start, since))
+
+    def store_range(self, key, start, end, series):
+        """Closed ranges get their own immutable entry; anything else replaces the key's sliding entry."""
+        if self.is_closed(end):
+            self.entries.set(("closed", key, start, end), RangeEntry(start, end, series), ttl=CACHE_CLOSED_TTL_SECONDS)
+        else:
+            self.entries.set(key, RangeEntry(start, end, series), ttl=CACHE_EXTEND_TTL_SECONDS)
+
+    def extend_range(self, key, start, end, tail, tail_series):
+        """Merge tail points fetched for (since, end] into the head from lookup_range and store [start, end]."""
+        _, head_series = tail
+        self.tail_fetches += 1
+
+        head = {s.topic: s for s in head_series}
+        merged = []
+        for series in tail_series:
+            if series.topic in head:
+                merged.append(concat_series(head.pop(series.topic), series))
+            else:
+                merged.append(series)
+        merged.extend(head.values())
+        merged = slice_series(merged, start, end)
+
+        self.store_range(key, start, end, merged)
+        return merged
+
+
+query_cache = QueryCache()
@@ -1,26 +1,104 @@
 import os
 from dotenv import load_dotenv
-import httpx
-from openai import OpenAI
 
 load_dotenv()
 
 GRAFANA_API_KEY = os.getenv("GRAFANA_API_KEY")
 GRAFANA_HOST = os.getenv("GRAFANA_HOST")
+GRAFANA_URL = os.getenv("GRAFANA_URL") or f"https://{GRAFANA_HOST}"  # override e.g. for a local stub
 INFLUX_DATASOURCE_UID = os.getenv("INFLUX_DATASOURCE_UID")
 INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "Factory")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Grafana HTTP client
+GRAFANA_TIMEOUT = float(os.getenv("GRAFANA_TIMEOUT", "15"))
+GRAFANA_MAX_CONNECTIONS = int(os.getenv("GRAFANA_MAX_CONNECTIONS", "20"))
+GRAFANA_MAX_CONCURRENCY = int(os.getenv("GRAFANA_MAX_CONCURRENCY", "4"))  # per-request fan-out cap
+GRAFANA_STREAM_DECODE = os.getenv("GRAFANA_STREAM_DECODE", "true").lower() == "true"  # incremental frame decode (needs ijson)
+GRAFANA_STREAM_DECODE_MIN_BYTES = int(os.getenv("GRAFANA_STREAM_DECODE_MIN_BYTES", str(8 << 20)))  # smaller bodies are buffered and json.loads'ed
+GRAFANA_BATCH_QUERIES = os.getenv("GRAFANA_BATCH_QUERIES", "true").lower() == "true"  # one multi-refId request per query
 
-os.environ.pop("HTTP_PROXY", None)
-os.environ.pop("HTTPS_PROXY", None)
-os.environ.pop("http_proxy", None)
-os.environ.pop("https_proxy", None)
+# Flux resolution planning
+MAX_POINTS_PER_SERIES = int(os.getenv("MAX_POINTS_PER_SERIES", "500"))  # aggregateWindow point budget
+FLUX_TOPICS_PER_QUERY = int(os.getenv("FLUX_TOPICS_PER_QUERY", "200"))  # larger topic sets are split into parallel sub-queries
 
-# OpenAI client
-openai_client = None
-if OPENAI_API_KEY:
-    try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=httpx.Client(verify=False))
-    except Exception as e:
-        print(f"OpenAI init failed: {e}")
+# Query planning
+QUERY_PLAN_CACHE_SIZE = int(os.getenv("QUERY_PLAN_CACHE_SIZE", "1024"))  # memoized parses, keyed by normalized text
+
+# Topic catalogue
+TOPIC_CATALOG_PATH = os.getenv("TOPIC_CATALOG_PATH", "")  # optional CSV: topic,sensor,device,site,line
+
+# Statistics
+STATS_TDIGEST_COMPRESSION = int(os.getenv("STATS_TDIGEST_COMPRESSION", "200"))  # percentile accuracy vs centroids kept
+
+# Query result cache
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "30"))  # sliding ranges served without refetch
+CACHE_EXTEND_TTL_SECONDS = int(os.getenv("CACHE_EXTEND_TTL_SECONDS", "900"))  # sliding ranges kept for tail extension
+CACHE_CLOSED_TTL_SECONDS = int(os.getenv("CACHE_CLOSED_TTL_SECONDS", "86400"))  # closed ranges, e.g. yesterday
+CACHE_ALIGN_SECONDS = int(os.getenv("CACHE_ALIGN_SECONDS", "60"))  # minimum time-bucket for range alignment
+
+# Rollup store (hourly / daily stats materialized in SQLite)
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "true").lower() == "true"
+ROLLUP_DB_PATH = os.getenv("ROLLUP_DB_PATH", "rollups.sqlite3")
+ROLLUP_INTERVAL_SECONDS = int(os.getenv("ROLLUP_INTERVAL_SECONDS", "300"))  # materializer pass period
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "7"))  # history loaded by the first pass
+ROLLUP_LATE_SECONDS = int(os.getenv("ROLLUP_LATE_SECONDS", "7200"))  # trailing hours re-read for late writes
+ROLLUP_BUSY_TIMEOUT_SECONDS = float(os.getenv("ROLLUP_BUSY_TIMEOUT_SECONDS", "5"))  # SQLite wait on a locked database
+
+# LLM summary rewrite (the OpenAI SDK is only imported when this is on and OPENAI_API_KEY is set)
+SUMMARY_REWRITE_ENABLED = os.getenv("SUMMARY_REWRITE_ENABLED", "true").lower() == "true"
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4.1-mini")
+SUMMARY_TIMEOUT_SECONDS = float(os.getenv("SUMMARY_TIMEOUT_SECONDS", "3"))  # fall back to the template after this
+SUMMARY_REWRITE_TIMEOUT_SECONDS = float(os.getenv("SUMMARY_REWRITE_TIMEOUT_SECONDS", "30"))  # hard cap on the (background) LLM call
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "512"))
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", "3600"))
+
+# Sensor status
+STATUS_OFFLINE_SECONDS = int(os.getenv("STATUS_OFFLINE_SECONDS", "600"))  # OFFLINE when last seen longer ago than this
+FLEET_STATUS_TOPIC_SUFFIX = os.getenv("FLEET_STATUS_TOPIC_SUFFIX", "/status")  # status topics for fleet queries
+FLEET_STATUS_REFRESH_SECONDS = int(os.getenv("FLEET_STATUS_REFRESH_SECONDS", "30"))  # last-seen registry answered from memory
+FLEET_STATUS_LOOKBACK_SECONDS = int(os.getenv("FLEET_STATUS_LOOKBACK_SECONDS", str(7 * 86400)))  # initial registry load
+
+# Live alerts (/alerts/ws, /alerts/stream)
+ALERT_POLL_SECONDS = int(os.getenv("ALERT_POLL_SECONDS", "30"))  # one shared upstream fetch per interval
+ALERT_LOOKBACK_SECONDS = int(os.getenv("ALERT_LOOKBACK_SECONDS", "900"))  # first poll, and the longest catch-up after idling
+ALERT_CONSTANT_READINGS = int(os.getenv("ALERT_CONSTANT_READINGS", "10"))  # identical consecutive readings flagged as constant
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "256"))  # per-subscriber backlog; oldest events dropped beyond it
+ALERT_HEARTBEAT_SECONDS = int(os.getenv("ALERT_HEARTBEAT_SECONDS", "15"))  # keep-alive while no alerts fire
+
+# Compact /nl-query responses
+COMPACT_PAGE_SIZE = int(os.getenv("COMPACT_PAGE_SIZE", "1000"))  # raw points per cursor page
+
+# /export
+EXPORT_CHUNK_SECONDS = int(os.getenv("EXPORT_CHUNK_SECONDS", "86400"))  # time range fetched per Grafana page
+EXPORT_READ_BYTES = int(os.getenv("EXPORT_READ_BYTES", "65536"))  # XLSX file read size when streaming it back
+EXPORT_DEADLINE_SECONDS = float(os.getenv("EXPORT_DEADLINE_SECONDS", "600"))  # time budget per export (body "timeout" can shorten it)
+
+# Request deadlines and admission control (/nl-query, /nl-query/batch, /nl-query/stream, /export)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))  # time budget per request (body "timeout" can shorten it)
+REQUEST_SUMMARY_SHARE = float(os.getenv("REQUEST_SUMMARY_SHARE", "0.2"))  # part of the budget kept for the summary rewrite
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))  # requests running at once
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "64"))  # requests waiting for a slot; more get 503
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))  # longest wait for a slot
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))  # Retry-After on 503
+
+# Batch /nl-query
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))  # questions per /nl-query/batch request
+
+# HTTP responses (/nl-query, /nl-query/batch)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # smaller JSON bodies are sent uncompressed
+COMPRESS_THREAD_BYTES = int(os.getenv("COMPRESS_THREAD_BYTES", "262144"))  # larger bodies are compressed off the event loop
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))  # 11 is far too slow for per-request bodies
+
+# Streaming /nl-query
+STREAM_CHUNK_POINTS = int(os.getenv("STREAM_CHUNK_POINTS", "500"))  # sample points per streamed chunk
+
+# Startup warm-up (GET /ready)
+WARMUP_GRAFANA_CONNECTIONS = int(os.getenv("WARMUP_GRAFANA_CONNECTIONS", "4"))  # pooled connections opened before ready
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))  # ready anyway after this, steps marked failed
+
+# Instrumentation
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"  # per-stage Server-Timing header
@@ -1,22 +1,17 @@
 # status_builder.py
 import time
 from datetime import datetime, timezone
+from app.series import to_epoch_seconds
+from app.config import STATUS_OFFLINE_SECONDS
 
-ONLINE_THRESHOLD_SECONDS = 300  # 5 minutes
+ONLINE_THRESHOLD_SECONDS = STATUS_OFFLINE_SECONDS
 
 def status_from_timestamp(ts: int) -> dict:
     """
     Convert a Unix timestamp to a readable online/offline status.
-    Automatically detects:
-    - nanoseconds -> converts to seconds
-    - milliseconds -> converts to seconds
+    Seconds, milliseconds and nanoseconds are detected by to_epoch_seconds.
     """
-    # Convert nanoseconds -> seconds
-    if ts > 1e18:  # larger than 1 quintillion -> nanoseconds
-        ts = ts / 1e9
-    # Convert milliseconds -> seconds
-    elif ts > 1e12:  # larger than 1 trillion -> milliseconds
-        ts = ts / 1e3
+    ts = to_epoch_seconds(ts)
 
     now = time.time()
     is_online = (now - ts) <= ONLINE_THRESHOLD_SECONDS
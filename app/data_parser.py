@@ -1,20 +1,36 @@
-import datetime
 import time
+from app.series import Series, to_epoch_ms, to_epoch_seconds
+from app.stats import StreamingStats
+from app.config import STATUS_OFFLINE_SECONDS
 
-OFFLINE_THRESHOLD_SECONDS = 10 * 60  # 10 minutes
+OFFLINE_THRESHOLD_SECONDS = STATUS_OFFLINE_SECONDS
 
 
 def status_from_timestamp(ts: int) -> str:
     now = int(time.time())
-    if (now - ts) <= OFFLINE_THRESHOLD_SECONDS:
+    if (now - to_epoch_seconds(ts)) <= OFFLINE_THRESHOLD_SECONDS:
         return "ONLINE"
     return "OFFLINE"
 
 
-def extract_points(resp, measurement):
-    points = []
+def select_results(resp, ref_id=None) -> list:
+    """results entries of resp: all, one refId or a list of refIds (sub-queries of one field)."""
+    results = resp.get("results", {})
+    if ref_id is None:
+        return list(results.values())
+    refs = [ref_id] if isinstance(ref_id, str) else ref_id
+    return [results[ref] for ref in refs if ref in results]
 
-    for r in resp.get("results", {}).values():
+
+def extract_series(resp, measurement, ref_id=None):
+    """
+    Read Grafana data frames into columnar Series (one per frame/topic).
+    ref_id: only read results[ref_id] (batched multi-refId responses);
+    a list of refIds reads every sub-query of a split field.
+    """
+    series = []
+
+    for r in select_results(resp, ref_id):
         for frame in r.get("frames", []):
             fields = frame.get("schema", {}).get("fields", [])
             values = frame.get("data", {}).get("values", [])
@@ -34,40 +50,142 @@ def extract_points(resp, measurement):
             if time_idx is None or value_idx is None:
                 continue
 
-            topic = fields[value_idx].get("labels", {}).get("topic", "")
+            topic = (fields[value_idx].get("labels") or {}).get("topic", "")
+
+            series.append(Series.from_columns(measurement, topic, values[time_idx], values[value_idx]))
+
+    return series
+
+
+def series_to_points(series, start=0, stop=None):
+    """
+    Materialize point dicts (ISO time, value, topic) for series[start:stop].
+    Status series are classified ONLINE / OFFLINE on the way out.
+    """
+    return [p for s in series for p in s.to_points(start, stop, OFFLINE_THRESHOLD_SECONDS)]
+
+
+def extract_points(resp, measurement, ref_id=None):
+    """Flatten Grafana data frames into point dicts (see extract_series)."""
+    return series_to_points(extract_series(resp, measurement, ref_id=ref_id))
+
+
+def extract_stats(resp, ref_id=None):
+    """
+    Read a build_stats_flux response into {"min_value", "max_value", "avg_value", "count"}.
+    Per-topic scalars are merged: min of mins, max of maxes, count-weighted mean.
+    With several refIds (topic chunks or time sub-ranges) each is merged too.
+    """
+    per_topic = {}
+
+    for n, r in enumerate(select_results(resp, ref_id)):
+        for frame in r.get("frames", []):
+            fields = frame.get("schema", {}).get("fields", [])
+            values = frame.get("data", {}).get("values", [])
+
+            if not fields or not values:
+                continue
+
+            names = [f.get("name") for f in fields]
+            value_idx = next((i for i, n in enumerate(names) if n in ["Value", "_value"]), None)
+            if value_idx is None:
+                continue
+
+            labels = fields[value_idx].get("labels") or {}
+            stat_col = values[names.index("stat")] if "stat" in names else None
+            topic_col = values[names.index("topic")] if "topic" in names else None
+
+            for i, val in enumerate(values[value_idx]):
+                if val is None or val != val:  # null / NaN
+                    continue
+                stat = stat_col[i] if stat_col is not None else labels.get("stat")
+                topic = topic_col[i] if topic_col is not None else labels.get("topic", "")
+                if stat:
+                    per_topic.setdefault((n, topic), {})[stat] = float(val)
+
+    return merge_stats(*(
+        {"min_value": s["min"], "max_value": s["max"], "avg_value": s["mean"], "count": int(s["count"])}
+        for s in per_topic.values() if s.get("count")
+    ))
+
+
+def merge_stats(*parts) -> dict:
+    """
+    Combine {"min_value", "max_value", "avg_value", "count"[, "stddev_value"]}
+    dicts of disjoint data: count-weighted mean, pooled stddev when every
+    part has one (StreamingStats.merge).
+    """
+    acc = StreamingStats(digest=False)
+    for s in parts:
+        acc.merge(StreamingStats.from_dict(s))
+    return acc.to_dict()
+
+
+def extract_last_seen(resp, ref_id=None):
+    """
+    Read a build_fleet_status_flux response into {topic: last-seen epoch seconds}.
+    Topics come from a "topic" column, or the value field's labels per frame.
+    """
+    last_seen = {}
+
+    for r in select_results(resp, ref_id):
+        for frame in r.get("frames", []):
+            fields = frame.get("schema", {}).get("fields", [])
+            values = frame.get("data", {}).get("values", [])
+
+            if not fields or not values:
+                continue
+
+            names = [f.get("name") for f in fields]
+            value_idx = next((i for i, n in enumerate(names) if n in ["Value", "_value"]), None)
+            if value_idx is None:
+                continue
+
+            labels = fields[value_idx].get("labels") or {}
+            topic_col = values[names.index("topic")] if "topic" in names else None
+
+            for i, val in enumerate(values[value_idx]):
+                if val is None or val != val:  # null / NaN
+                    continue
+                topic = topic_col[i] if topic_col is not None else labels.get("topic", "")
+                seen = to_epoch_seconds(val)
+                if seen > last_seen.get(topic, 0):
+                    last_seen[topic] = seen
+
+    return last_seen
+
+
+def extract_rollups(resp, ref_id=None):
+    """
+    Read a build_rollup_flux response into {(topic, window start epoch s): {stat: value}}.
+    """
+    rollups = {}
+
+    for r in select_results(resp, ref_id):
+        for frame in r.get("frames", []):
+            fields = frame.get("schema", {}).get("fields", [])
+            values = frame.get("data", {}).get("values", [])
+
+            if not fields or not values:
+                continue
+
+            names = [f.get("name") for f in fields]
+            time_idx = next((i for i, n in enumerate(names) if n in ["Time", "time", "_time"]), None)
+            value_idx = next((i for i, n in enumerate(names) if n in ["Value", "_value"]), None)
+            if time_idx is None or value_idx is None:
+                continue
 
-            for i in range(len(values[time_idx])):
-                ts = values[time_idx][i]
-                val = values[value_idx][i]
+            labels = fields[value_idx].get("labels") or {}
+            stat_col = values[names.index("stat")] if "stat" in names else None
+            topic_col = values[names.index("topic")] if "topic" in names else None
+            buckets = to_epoch_ms(values[time_idx]) // 1000
 
-                if val is None:
+            for i, val in enumerate(values[value_idx]):
+                if val is None or val != val:  # null / NaN
                     continue
+                stat = stat_col[i] if stat_col is not None else labels.get("stat")
+                topic = topic_col[i] if topic_col is not None else labels.get("topic", "")
+                if stat:
+                    rollups.setdefault((topic, int(buckets[i])), {})[stat] = float(val)
 
-                # Convert Grafana time to ISO
-                if isinstance(ts, (int, float)):
-                    ts = datetime.datetime.utcfromtimestamp(ts / 1000).isoformat() + "Z"
-
-                # ---------------- STATUS LOGIC ----------------
-                if measurement in ["status", "sensor_status"]:
-                    status_text = status_from_timestamp(int(val))
-                    print("status",status_text)
-
-                    points.append({
-                        "time": ts,
-                        "value": status_text,
-                        "measurement": "status",
-                        "field": "status",
-                        "topic": topic
-                    })
-
-                # ---------------- NUMERIC SENSORS ----------------
-                else:
-                    points.append({
-                        "time": ts,
-                        "value": float(val),
-                        "measurement": measurement,
-                        "field": measurement,
-                        "topic": topic
-                    })
-
-    return points
+    return rollups
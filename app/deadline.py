@@ -0,0 +1,30 @@
+# deadline.py
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# time.monotonic() by which the current request must answer; None = no deadline.
+# Tasks copy it when created, so fetches started for a request share its deadline.
+request_deadline = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float = None):
+    """Give the enclosed work seconds from now (None: no deadline)."""
+    token = request_deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline (<= 0 once passed), None without one."""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def budget(share: float = 1.0):
+    """share of the time left (never negative), None without a deadline."""
+    left = remaining()
+    return None if left is None else max(0.0, left * share)
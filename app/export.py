@@ -0,0 +1,244 @@
+# export.py
+import asyncio
+import csv
+import datetime
+import io
+import os
+import tempfile
+import numpy as np
+from app.pipeline import prepare_query, fetch_responses
+from app.flux_builder import build_flux, plan_window, split_topics
+from app.data_parser import extract_series, OFFLINE_THRESHOLD_SECONDS
+from app.grafana import result_error
+from app.series import iso_times
+from app.stats import StreamingStats
+from app.metrics import timed, POINTS_RETURNED
+from app.sensor import SENSOR_CONFIG
+from app.config import EXPORT_CHUNK_SECONDS, EXPORT_READ_BYTES
+
+COLUMNS = ["time", "topic", "value"]
+SUMMARY_COLUMNS = ["field", "unit", "topics", "points", "min", "max", "mean", "first", "last"]
+EXCEL_EPOCH_DAYS = 25569  # 1970-01-01 as an Excel serial date
+EXCEL_MAX_ROWS = 1048576  # rows per worksheet, header included
+
+
+def time_chunks(start, end, seconds: int = EXPORT_CHUNK_SECONDS) -> list:
+    """[start, end) -> consecutive (chunk_start, chunk_end) pages of at most seconds each."""
+    step = datetime.timedelta(seconds=seconds)
+    chunks = []
+    while start < end:
+        chunks.append((start, min(start + step, end)))
+        start += step
+    return chunks
+
+
+class FieldTotals:
+    """Running count / min / max / mean of one field's exported values."""
+
+    __slots__ = ("topics", "points", "values", "first", "last")
+
+    def __init__(self):
+        self.topics = set()
+        self.points = 0
+        self.values = StreamingStats(digest=False)
+        self.first = self.last = None
+
+    def add(self, series, numeric: bool = True):
+        if not len(series):
+            return
+        self.topics.add(series.topic)
+        self.points += len(series)
+        first, last = int(series.times[0]), int(series.times[-1])
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+        if numeric:
+            self.values.update(series.values)
+
+    def row(self, field: str) -> list:
+        stats = self.values.to_dict()
+        return [
+            field,
+            SENSOR_CONFIG[field].get("unit", "").strip(),
+            len(self.topics),
+            self.points,
+            stats["min_value"],
+            stats["max_value"],
+            stats["avg_value"],
+            iso_time(self.first),
+            iso_time(self.last),
+        ]
+
+
+def iso_time(ms):
+    return None if ms is None else str(iso_times(np.array([ms], dtype="int64"))[0])
+
+
+def series_rows(series) -> tuple:
+    """(iso times, values) of one series; status values become ONLINE / OFFLINE."""
+    values = series.status_labels(OFFLINE_THRESHOLD_SECONDS) if series.is_status else series.values
+    return iso_times(series.times).tolist(), values.tolist()
+
+
+async def export_series(client, prepared: dict, every: str = None):
+    """
+    Yield (field, [Series]) one time chunk at a time, field after field,
+    with the next chunk's Grafana request already in flight while the
+    current one is written out. Only one chunk is held in memory.
+    """
+    start, end = prepared["start"], prepared["end"]
+    chunks = time_chunks(start, end)
+    every = every or plan_window(start, start + datetime.timedelta(seconds=EXPORT_CHUNK_SECONDS))
+    jobs = [(field, cs, ce) for field in prepared["fields"] for cs, ce in chunks]
+
+    async def fetch(field, cs, ce):
+        plan = prepared["plans"][field]
+        fluxes = [
+            build_flux(start=cs, end=ce, topics=topics, measurement=SENSOR_CONFIG[field]["measurement"], every=every)
+            for topics in split_topics(plan["topics"])
+        ] if plan["topics"] else []
+        responses = await fetch_responses(client, {field: fluxes}, batch=True)
+        resp, ref_ids = responses[field]
+        error = result_error(resp, ref_ids)
+        if error:
+            # a missing page would otherwise look like a complete export
+            raise RuntimeError(f"Grafana error exporting {field} {cs.isoformat()} – {ce.isoformat()}: {error}")
+        with timed("extract_points"):
+            return [s.filter(prepared["thresholds"]) for s in extract_series(resp, field, ref_id=ref_ids)]
+
+    pending = asyncio.ensure_future(fetch(*jobs[0])) if jobs else None
+    try:
+        for i, (field, _, _) in enumerate(jobs):
+            series = await pending
+            pending = asyncio.ensure_future(fetch(*jobs[i + 1])) if i + 1 < len(jobs) else None
+            POINTS_RETURNED.inc(sum(len(s) for s in series), field=field)
+            yield field, series
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+# ---------------- CSV ----------------
+
+async def export_csv(client, query: str, every: str = None):
+    """
+    CSV text, page by page: one field,time,topic,value row per point (fields
+    in question order), then a blank line and a per-field summary section.
+    """
+    prepared = prepare_query(query, stats_only=False)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    totals = {field: FieldTotals() for field in prepared["fields"]}
+
+    writer.writerow(["field", *COLUMNS])
+    yield buf.getvalue()
+
+    async for field, series in export_series(client, prepared, every):
+        buf.seek(0)
+        buf.truncate()
+        for s in series:
+            totals[field].add(s, numeric=not s.is_status)
+            times, values = series_rows(s)
+            writer.writerows(zip([field] * len(s), times, [s.topic] * len(s), values))
+        yield buf.getvalue()
+
+    buf.seek(0)
+    buf.truncate()
+    writer.writerow([])
+    writer.writerow(SUMMARY_COLUMNS)
+    writer.writerows(t.row(field) for field, t in totals.items())
+    yield buf.getvalue()
+
+
+# ---------------- XLSX ----------------
+
+class XlsxExport:
+    """
+    Workbook in xlsxwriter constant_memory mode: rows are flushed to disk
+    as they are written, so memory stays flat however long the range is.
+    A Summary sheet comes first, then one sheet per field; a field with
+    more rows than a worksheet holds continues on "<field> (2)", "(3)", ...
+    """
+
+    def __init__(self, path: str, prepared: dict):
+        import xlsxwriter  # on the first XLSX export rather than at startup
+
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.bold = self.workbook.add_format({"bold": True})
+        self.date = self.workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        self.summary = self.workbook.add_worksheet("Summary")
+        self.sheets = {}  # field -> the sheet currently written
+        self.parts = {}  # field -> number of sheets so far
+        self.rows = {}
+        self.prepared = prepared
+
+        for field in prepared["fields"]:
+            self.parts[field] = 0
+            self.add_sheet(field)
+
+    def add_sheet(self, field: str):
+        self.parts[field] += 1
+        part = self.parts[field]
+        sheet = self.workbook.add_worksheet(field[:31] if part == 1 else f"{field[:24]} ({part})")
+        sheet.write_row(0, 0, ["time (UTC)", "topic", "value"], self.bold)
+        sheet.set_column(0, 0, 20)
+        sheet.set_column(1, 1, 40)
+        self.sheets[field] = sheet
+        self.rows[field] = 1
+
+    def write_series(self, field: str, series):
+        sheet, row = self.sheets[field], self.rows[field]
+        serials = (series.times / 86400000 + EXCEL_EPOCH_DAYS).tolist()
+        values = series.status_labels(OFFLINE_THRESHOLD_SECONDS).tolist() if series.is_status else series.values.tolist()
+        for serial, value in zip(serials, values):
+            if row == EXCEL_MAX_ROWS:
+                self.add_sheet(field)
+                sheet, row = self.sheets[field], self.rows[field]
+            written = (
+                sheet.write_number(row, 0, serial, self.date),
+                sheet.write_string(row, 1, series.topic),
+                sheet.write_string(row, 2, value) if series.is_status else sheet.write_number(row, 2, value),
+            )
+            if any(written):  # xlsxwriter returns -1 etc. instead of raising
+                raise RuntimeError(f"XLSX write failed on {field} row {row}: {written}")
+            row += 1
+        self.rows[field] = row
+
+    def close(self, totals: dict):
+        prepared = self.prepared
+        self.summary.write_row(0, 0, ["query", prepared["query"]])
+        self.summary.write_row(1, 0, ["from (UTC)", prepared["start"].isoformat()])
+        self.summary.write_row(2, 0, ["to (UTC)", prepared["end"].isoformat()])
+        self.summary.write_row(4, 0, SUMMARY_COLUMNS, self.bold)
+        for i, (field, t) in enumerate(totals.items()):
+            self.summary.write_row(5 + i, 0, t.row(field))
+        self.workbook.close()
+
+
+async def export_xlsx(client, query: str, every: str = None):
+    """
+    XLSX bytes. The workbook is built in a temporary file as chunks arrive
+    (writes run off the event loop), then streamed back and deleted. An
+    XLSX zip ends with its central directory, so nothing is yielded before
+    the last page has been fetched and the workbook closed.
+    """
+    prepared = prepare_query(query, stats_only=False)
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        xlsx = XlsxExport(path, prepared)
+        totals = {field: FieldTotals() for field in prepared["fields"]}
+
+        def write(field, series):
+            for s in series:
+                totals[field].add(s, numeric=not s.is_status)
+                xlsx.write_series(field, s)
+
+        async for field, series in export_series(client, prepared, every):
+            await asyncio.to_thread(write, field, series)
+        await asyncio.to_thread(xlsx.close, totals)
+
+        with open(path, "rb") as f:
+            while chunk := f.read(EXPORT_READ_BYTES):
+                yield chunk
+    finally:
+        os.remove(path)
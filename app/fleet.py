@@ -0,0 +1,117 @@
+# fleet.py
+import datetime
+import threading
+import time
+from app.flux_builder import build_fleet_status_flux
+from app.data_parser import extract_last_seen
+from app.grafana import query_grafana
+from app.singleflight import fetch_flight
+from app.sensor import SENSOR_CONFIG, STATUS_MAP
+from app.topics import topic_registry
+from app.series import STATUS_MEASUREMENTS
+from app.config import (
+    STATUS_OFFLINE_SECONDS,
+    FLEET_STATUS_TOPIC_SUFFIX,
+    FLEET_STATUS_REFRESH_SECONDS,
+    FLEET_STATUS_LOOKBACK_SECONDS,
+    CACHE_ALIGN_SECONDS,
+)
+
+# Configured status topics are always part of the fleet, whatever their suffix
+STATUS_TOPICS = tuple(
+    t for field, cfg in SENSOR_CONFIG.items() if cfg["measurement"] in STATUS_MEASUREMENTS
+    for t in topic_registry.lookup(field)
+)
+
+
+class LastSeenRegistry:
+    """
+    Process-wide topic -> last-seen epoch seconds for every status topic.
+    The first refresh loads FLEET_STATUS_LOOKBACK_SECONDS of history; later
+    ones only query the range since the previous refresh (minus a small
+    overlap for late writes) and keep the newest timestamp per topic, so
+    fleet status is answered from memory in O(sensors).
+    """
+
+    def __init__(self):
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        self.watermark = None  # end of the last refreshed range (UTC)
+        self.refreshed_at = None  # time.monotonic() of the last refresh
+        self.refreshes = 0
+
+    def observe(self, last_seen: dict):
+        """Merge {topic: epoch seconds}, keeping the newest timestamp per topic."""
+        with self._lock:
+            for topic, seen in last_seen.items():
+                if seen > self._last_seen.get(topic, 0):
+                    self._last_seen[topic] = seen
+
+    def is_fresh(self, max_age: float = FLEET_STATUS_REFRESH_SECONDS) -> bool:
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < max_age
+
+    async def refresh(self, client, force: bool = False):
+        """Bring the registry up to date with one grouped last() query (shared by concurrent callers)."""
+        if force or not self.is_fresh():
+            await fetch_flight.run(("fleet_status",), lambda: self._refresh(client))
+
+    async def _refresh(self, client):
+        end = datetime.datetime.now(datetime.timezone.utc)
+        if self.watermark is None:
+            start = end - datetime.timedelta(seconds=FLEET_STATUS_LOOKBACK_SECONDS)
+        else:
+            start = self.watermark - datetime.timedelta(seconds=CACHE_ALIGN_SECONDS)
+
+        flux = build_fleet_status_flux(start, end, FLEET_STATUS_TOPIC_SUFFIX, STATUS_TOPICS)
+        resp = await query_grafana(client, flux)
+        self.observe(extract_last_seen(resp))
+
+        self.watermark = end
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    def snapshot(self, now: float = None, threshold_seconds: int = STATUS_OFFLINE_SECONDS) -> list:
+        """[{"topic", "status", "last_seen"}] sorted by topic; status is ONLINE / OFFLINE."""
+        now = time.time() if now is None else now
+        with self._lock:
+            items = sorted(self._last_seen.items())
+        return [
+            {
+                "topic": topic,
+                "status": "ONLINE" if now - seen <= threshold_seconds else "OFFLINE",
+                "last_seen": seen,
+            }
+            for topic, seen in items
+        ]
+
+    def __len__(self):
+        return len(self._last_seen)
+
+
+def last_seen_iso(seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def fleet_counts(snapshot: list) -> dict:
+    online = sum(1 for s in snapshot if s["status"] == "ONLINE")
+    return {"sensors": len(snapshot), "online": online, "offline": len(snapshot) - online}
+
+
+def fleet_reasoning(snapshot: list, max_listed: int = 10) -> str:
+    """'41 of 45 sensors are Online. Offline: a (last seen ...), ...'"""
+    if not snapshot:
+        return "No status data recorded for any sensor."
+
+    counts = fleet_counts(snapshot)
+    text = f"{counts['online']} of {counts['sensors']} sensors are {STATUS_MAP['online']}."
+
+    offline = sorted((s for s in snapshot if s["status"] == "OFFLINE"), key=lambda s: s["last_seen"])
+    if offline:
+        listed = ", ".join(f"{s['topic']} (last seen {last_seen_iso(s['last_seen'])})" for s in offline[:max_listed])
+        more = f" and {len(offline) - max_listed} more" if len(offline) > max_listed else ""
+        text += f" {STATUS_MAP['offline']}: {listed}{more}."
+    return text
+
+
+# Shared by all requests; per-topic status fetches feed it as well
+fleet_registry = LastSeenRegistry()
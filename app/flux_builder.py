@@ -1,43 +1,212 @@
 # fluxbuilder.py
-from app.config import INFLUX_BUCKET
+from app.config import INFLUX_BUCKET, MAX_POINTS_PER_SERIES, FLUX_TOPICS_PER_QUERY
+from functools import lru_cache
 import datetime
+import json
+
+# Candidate aggregateWindow sizes (seconds, Flux duration), finest first
+WINDOW_STEPS = [
+    (10, "10s"),
+    (30, "30s"),
+    (60, "1m"),
+    (300, "5m"),
+    (900, "15m"),
+    (1800, "30m"),
+    (3600, "1h"),
+    (3 * 3600, "3h"),
+    (6 * 3600, "6h"),
+    (12 * 3600, "12h"),
+    (86400, "1d"),
+    (7 * 86400, "1w"),
+]
+WINDOW_SECONDS = {every: seconds for seconds, every in WINDOW_STEPS}
+
+# Query intent (see parse_aggregations) -> aggregateWindow fn
+WINDOW_FNS = {"min": "min", "max": "max", "mean": "mean"}
 
 def flux_time(dt: datetime.datetime):
     """Convert datetime to RFC3339 format (UTC) for Flux queries."""
     return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def build_flux(start, end, topics, measurement: str):
+# Characters escaped in a Flux regex literal: RE2 metacharacters and the / delimiter
+REGEX_SPECIAL = set("\\.+*?()|[]{}^$/")
+
+
+def flux_regex_literal(text: str) -> str:
+    """text escaped to match itself inside a Flux /.../ regex literal."""
+    return "".join("\\" + c if c in REGEX_SPECIAL else c for c in text)
+
+
+@lru_cache(maxsize=1024)
+def topic_filter(topics: tuple) -> str:
+    """
+    Flux predicate for a topic set: a plain equality for one topic, an
+    anchored tag regex otherwise. Both are pushed down to the storage
+    engine, which then reads only the matching series; contains() and
+    string functions are evaluated in memory over every series in range.
+    """
+    if len(topics) == 1:
+        return f"r.topic == {json.dumps(topics[0], ensure_ascii=False)}"
+    return f"r.topic =~ /^(?:{'|'.join(flux_regex_literal(t) for t in topics)})$/"
+
+
+def split_topics(topics, size: int = FLUX_TOPICS_PER_QUERY) -> list:
+    """Topic set -> chunks of at most size topics, one sub-query each."""
+    topics = tuple(topics)
+    return [topics[i:i + size] for i in range(0, len(topics), size)] or [()]
+
+
+def plan_window(start, end, max_points: int = MAX_POINTS_PER_SERIES) -> str:
+    """
+    Pick the finest aggregateWindow that keeps (end - start) / window
+    within max_points per series, e.g. last 1 hours -> 10s, last 4 weeks -> 3h.
+    """
+    span = max((end - start).total_seconds(), 0)
+    for seconds, every in WINDOW_STEPS:
+        if span / seconds <= max_points:
+            return every
+    return WINDOW_STEPS[-1][1]
+
+
+def window_fn(aggregations) -> str:
+    """
+    Aggregate function for the question's intent: a single min/max/avg
+    intent picks that function, anything else falls back to mean.
+    """
+    if len(aggregations) == 1:
+        return WINDOW_FNS.get(aggregations[0], "mean")
+    return "mean"
+
+
+def build_flux(start, end, topics, measurement: str, every: str = None, fn: str = "mean"):
     """
     Build a Flux query for InfluxDB.
     
     - start, end: datetime objects
     - topics: list of topic strings
     - measurement: measurement name ("status" or others)
+    - every: aggregateWindow size (default: plan_window(start, end))
+    - fn: aggregateWindow function
     """
-    topic_filter = " or ".join([f'r.topic == "{t}"' for t in topics])
-
     flux = f"""
 from(bucket: "{INFLUX_BUCKET}")
   |> range(start: time(v: "{flux_time(start)}"), stop: time(v: "{flux_time(end)}"))
-  |> filter(fn: (r) => ({topic_filter}) and exists r._value)
+  |> filter(fn: (r) => {topic_filter(tuple(topics))} and exists r._value)
 """
 
     if measurement == "status":
-        # Convert _value to seconds to simplify downstream processing
+        # Raw last-seen timestamp; s / ms / ns is resolved by to_epoch_seconds
         flux += """
   |> last()
   |> map(fn: (r) => ({
       r with
-      _value: float(v: r._value) / 1000000000.0  // nanoseconds -> seconds
+      _value: float(v: r._value)
   }))
 """
     else:
-        flux += """
-  |> aggregateWindow(every: 5m, fn: mean, createEmpty: false)
+        flux += f"""
+  |> aggregateWindow(every: {every or plan_window(start, end)}, fn: {fn}, createEmpty: false)
 """
 
     flux += """
   |> keep(columns: ["_time", "_value", "topic"])
 """
-    return flux.strip()
\ No newline at end of file
+    return flux.strip()
+
+
+def build_raw_flux(start, end, topics):
+    """Raw readings of topics in [start, end), without windowing (short incremental ranges only)."""
+    flux = f"""
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: time(v: "{flux_time(start)}"), stop: time(v: "{flux_time(end)}"))
+  |> filter(fn: (r) => {topic_filter(tuple(topics))} and exists r._value)
+  |> keep(columns: ["_time", "_value", "topic"])
+"""
+    return flux.strip()
+
+
+def threshold_predicate(thresholds) -> str:
+    """[("<", 20.0), (">", 5.0)] -> 'r._value < 20.0 and r._value > 5.0'"""
+    return " and ".join(f"r._value {op} {float(value)}" for op, value in thresholds)
+
+
+STATS_REDUCERS = ["min", "max", "mean", "count"]
+
+
+def build_stats_flux(start, end, topics, thresholds=()):
+    """
+    Stats-only Flux query: threshold filter and min/max/mean/count run inside
+    Influx on raw data, returning one scalar per (topic, stat) instead of
+    every aggregated window.
+    """
+    flux = f"""
+data = from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: time(v: "{flux_time(start)}"), stop: time(v: "{flux_time(end)}"))
+  |> filter(fn: (r) => {topic_filter(tuple(topics))} and exists r._value)
+"""
+    if thresholds:
+        flux += f"""  |> filter(fn: (r) => {threshold_predicate(thresholds)})
+"""
+    flux += """  |> group(columns: ["topic"])
+
+"""
+    reductions = ",\n".join(
+        f'  data |> {fn}() |> map(fn: (r) => ({{topic: r.topic, stat: "{fn}", _value: float(v: r._value)}}))'
+        for fn in STATS_REDUCERS
+    )
+    flux += f"""union(tables: [
+{reductions}
+])
+  |> group(columns: ["topic", "stat"])
+"""
+    return flux.strip()
+
+
+def build_fleet_status_flux(start, end, suffix: str, topics=()):
+    """
+    Fleet status: last() of every status topic (topics ending in suffix, plus
+    any listed explicitly) in one query, as a single topic/_time/_value table.
+    The suffix is matched with a tag regex so the storage engine only reads
+    status series (strings.hasSuffix() would scan the whole bucket).
+    """
+    status_filter = f"r.topic =~ /{flux_regex_literal(suffix)}$/"
+    if topics:
+        status_filter += f" or {topic_filter(tuple(topics))}"
+
+    flux = f"""
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: time(v: "{flux_time(start)}"), stop: time(v: "{flux_time(end)}"))
+  |> filter(fn: (r) => ({status_filter}) and exists r._value)
+  |> group(columns: ["topic"])
+  |> last()
+  |> map(fn: (r) => ({{topic: r.topic, _time: r._time, _value: float(v: r._value)}}))
+  |> group()
+"""
+    return flux.strip()
+
+
+def build_rollup_flux(start, end, topics, every: str = "1h"):
+    """
+    Per-window min/max/mean/count of each topic, for the rollup store: one
+    row per (topic, stat, window) labelled with the window start. A topic
+    with several series (extra tags or _fields) is aggregated as one.
+    """
+    flux = f"""
+data = from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: time(v: "{flux_time(start)}"), stop: time(v: "{flux_time(end)}"))
+  |> filter(fn: (r) => {topic_filter(tuple(topics))} and exists r._value)
+  |> group(columns: ["topic"])
+
+"""
+    windows = ",\n".join(
+        f'  data |> aggregateWindow(every: {every}, fn: {fn}, createEmpty: false, timeSrc: "_start")'
+        f' |> map(fn: (r) => ({{topic: r.topic, stat: "{fn}", _time: r._time, _value: float(v: r._value)}}))'
+        for fn in STATS_REDUCERS
+    )
+    flux += f"""union(tables: [
+{windows}
+])
+  |> group(columns: ["topic", "stat"])
+"""
+    return flux.strip()
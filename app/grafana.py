@@ -0,0 +1,186 @@
+# grafana.py
+import asyncio
+import json
+import time
+import httpx
+from app.deadline import remaining
+from app.metrics import timed, record_stage, BYTES_RECEIVED, GRAFANA_REQUESTS
+from app.frame_stream import ijson, decode_ds_response
+from app.config import (
+    GRAFANA_API_KEY,
+    GRAFANA_URL,
+    INFLUX_DATASOURCE_UID,
+    GRAFANA_TIMEOUT,
+    GRAFANA_MAX_CONNECTIONS,
+    GRAFANA_STREAM_DECODE,
+    GRAFANA_STREAM_DECODE_MIN_BYTES,
+)
+
+DS_QUERY_PATH = "/api/ds/query"
+HEALTH_PATH = "/api/health"
+
+
+class GrafanaTimeout(TimeoutError):
+    """/api/ds/query did not answer within GRAFANA_TIMEOUT or the request's deadline."""
+
+
+class GrafanaError(RuntimeError):
+    """/api/ds/query failed upstream: a 5xx answer or a body that is not valid JSON (e.g. a proxy's 502 page)."""
+
+
+def check_status(status_code: int, body: bytes = b""):
+    """Raise GrafanaError on 5xx. Query errors come back as 4xx with a JSON body and are left to result_error()."""
+    if status_code >= 500:
+        raise GrafanaError(f"Grafana answered HTTP {status_code}: {body[:200].decode('utf-8', 'replace')}")
+
+
+def create_grafana_client() -> httpx.AsyncClient:
+    """
+    Build the long-lived, connection-pooled client used for every
+    /api/ds/query call. Created once at app startup and closed on shutdown.
+    """
+    return httpx.AsyncClient(
+        base_url=GRAFANA_URL,
+        headers={
+            "Authorization": f"Bearer {GRAFANA_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        verify=False,
+        timeout=GRAFANA_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=GRAFANA_MAX_CONNECTIONS,
+            max_keepalive_connections=GRAFANA_MAX_CONNECTIONS,
+        ),
+        trust_env=False,  # never route through HTTP(S)_PROXY
+    )
+
+
+async def warm_connections(client: httpx.AsyncClient, connections: int) -> int:
+    """
+    Open up to `connections` pooled keep-alive connections (TCP + TLS) with
+    concurrent GET /api/health calls, so the first queries skip the
+    handshakes. Any HTTP answer counts; the connection is what matters.
+    """
+    await asyncio.gather(*(client.get(HEALTH_PATH) for _ in range(connections)))
+    return connections
+
+
+def build_query(flux: str, ref_id: str = "A") -> dict:
+    """Single Flux query entry for the /api/ds/query payload."""
+    return {
+        "refId": ref_id,
+        "datasource": {
+            "type": "influxdb",
+            "uid": INFLUX_DATASOURCE_UID
+        },
+        "queryType": "flux",
+        "rawQuery": True,
+        "query": flux
+    }
+
+
+async def post_queries(client: httpx.AsyncClient, queries: list) -> dict:
+    """
+    POST queries to /api/ds/query and decode the JSON body; an upstream
+    failure raises GrafanaError. With GRAFANA_STREAM_DECODE (and ijson installed) a body larger than
+    GRAFANA_STREAM_DECODE_MIN_BYTES is decoded frame by frame while it
+    downloads instead of buffered and json.loads'ed.
+    The whole call, download included, ends at the request's deadline
+    (app.deadline); timeouts of either kind raise GrafanaTimeout.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        GRAFANA_REQUESTS.inc(status="timeout")
+        raise GrafanaTimeout("Request deadline passed before the Grafana query")
+    try:
+        return await asyncio.wait_for(send_queries(client, queries), left)
+    except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+        GRAFANA_REQUESTS.inc(status="timeout")
+        raise GrafanaTimeout("Grafana query timed out") from e
+
+
+async def send_queries(client: httpx.AsyncClient, queries: list) -> dict:
+    if GRAFANA_STREAM_DECODE and ijson is not None:
+        return await stream_queries(client, queries)
+
+    with timed("grafana_http"):
+        r = await client.post(DS_QUERY_PATH, json={"queries": queries})
+
+    GRAFANA_REQUESTS.inc(status=r.status_code)
+    BYTES_RECEIVED.inc(len(r.content))
+    check_status(r.status_code, r.content)
+
+    with timed("json_decode"):
+        try:
+            return r.json()
+        except ValueError as e:
+            raise GrafanaError(f"Grafana answered HTTP {r.status_code} with a body that is not JSON") from e
+
+
+async def stream_queries(client: httpx.AsyncClient, queries: list) -> dict:
+    start = time.perf_counter()
+    async with client.stream("POST", DS_QUERY_PATH, json={"queries": queries}) as r:
+        record_stage("grafana_http", time.perf_counter() - start)  # time to response headers
+        GRAFANA_REQUESTS.inc(status=r.status_code)
+        if r.status_code >= 500:
+            check_status(r.status_code, await r.aread())
+
+        with timed("json_decode"):
+            try:
+                resp, received = await decode_body(r.aiter_bytes())
+            except (ValueError, ijson.JSONError) as e:
+                raise GrafanaError(f"Grafana answered HTTP {r.status_code} with a body that is not JSON") from e
+
+    BYTES_RECEIVED.inc(received)
+    return resp
+
+
+async def decode_body(chunks, min_stream_bytes: int = GRAFANA_STREAM_DECODE_MIN_BYTES) -> tuple:
+    """
+    (response dict, bytes read) of a streamed body. The incremental decoder
+    costs several times json.loads in CPU, so it only takes over once
+    min_stream_bytes have arrived (multi-week pulls); the usual small body
+    is buffered and parsed in one go.
+    """
+    head = []
+    size = 0
+    async for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_stream_bytes:
+            async def body():
+                for buffered in head:
+                    yield buffered
+                async for rest in chunks:
+                    yield rest
+
+            return await decode_ds_response(body())
+    return json.loads(b"".join(head)), size
+
+
+async def query_grafana(client: httpx.AsyncClient, flux: str) -> dict:
+    """Run one Flux query through Grafana and return the decoded response."""
+    return await post_queries(client, [build_query(flux)])
+
+
+async def query_grafana_batch(client: httpx.AsyncClient, fluxes: dict) -> dict:
+    """
+    Run several Flux queries in one /api/ds/query request.
+    fluxes maps refId -> Flux; the response's results are keyed by the same refIds.
+    """
+    return await post_queries(client, [build_query(flux, ref_id) for ref_id, flux in fluxes.items()])
+
+
+def result_error(resp: dict, ref_id=None):
+    """
+    Error message of results[ref_id] (or of any result), None if the query succeeded.
+    ref_id: one refId or a list of them (a field split into sub-queries).
+    """
+    results = resp.get("results", {})
+    if ref_id is not None:
+        refs = [ref_id] if isinstance(ref_id, str) else ref_id
+        results = {ref: results.get(ref, {"error": f"missing refId {ref}"}) for ref in refs}
+    for r in results.values():
+        if r.get("error"):
+            return r["error"]
+    return resp.get("message") if not results else None
@@ -1,16 +1,63 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, AsyncExitStack
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from app.nlp_parser import parse_nl_query
-from app.flux_builder import build_flux
-from app.data_parser import extract_points
-from app.summary import compute_summary
-from app.sensor import SENSOR_CONFIG, STATUS_MAP
-from app.config import GRAFANA_API_KEY, GRAFANA_HOST, INFLUX_DATASOURCE_UID
-import requests
+from starlette.background import BackgroundTask
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from app.grafana import create_grafana_client, GrafanaError
+from app.pipeline import prepare_query, run_nl_query, run_nl_batch, stream_nl_query, page_nl_query
+from app.export import export_csv, export_xlsx
+from app.flux_builder import WINDOW_SECONDS
+from app.summary import get_rewrite, rewrite_cache, rewrite_flight
+from app.cache import query_cache
+from app.singleflight import fetch_flight, request_flight
+from app.fleet import fleet_registry
+from app.nlp_parser import compile_plan
+from app.rollups import materializer
+from app.alerts import alert_monitor, parse_alert_fields
+from app.admission import admission, Overloaded
+from app.deadline import deadline_scope
+from app.warmup import warmup
+from app.responses import FastJSONResponse, json_response, answer_validator, etag_matches, not_modified
+from app.metrics import (
+    register,
+    render_metrics,
+    request_timings,
+    server_timing_header,
+    Callback,
+    REQUEST_SECONDS,
+)
+from app.config import (
+    SERVER_TIMING_ENABLED,
+    CACHE_ENABLED,
+    COMPACT_PAGE_SIZE,
+    ROLLUP_ENABLED,
+    BATCH_MAX_QUERIES,
+    REQUEST_DEADLINE_SECONDS,
+    EXPORT_DEADLINE_SECONDS,
+)
+import json
 import logging
-import re
+import time
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Grafana client per worker, reused by every request;
+    # its connections and the OpenAI client are warmed up in the background (GET /ready)
+    app.state.grafana_client = create_grafana_client()
+    warmup.start(app.state.grafana_client)
+    if ROLLUP_ENABLED:
+        materializer.start(app.state.grafana_client)
+    try:
+        yield
+    finally:
+        await warmup.stop()
+        await alert_monitor.stop()
+        await materializer.stop()
+        await app.state.grafana_client.aclose()
 
-app = FastAPI(title="Agentic Smart Factory API")
+
+app = FastAPI(title="Agentic Smart Factory API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,181 +66,466 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------------- Scrape-time metrics ----------------
+register(Callback("nlquery_query_cache_entries", "Entries in the query result cache.", lambda: len(query_cache.entries)))
+register(Callback("nlquery_summary_cache_entries", "Entries in the LLM rewrite cache.", lambda: len(rewrite_cache)))
+register(Callback(
+    "nlquery_cache_tail_fetches_total", "Sliding ranges served by a tail fetch.",
+    lambda: query_cache.tail_fetches, kind="counter",
+))
+register(Callback("nlquery_plan_cache_entries", "Memoized query plans.", lambda: compile_plan.cache_info().currsize))
+register(Callback(
+    "nlquery_plan_cache_hits_total", "Questions answered from the query plan cache.",
+    lambda: compile_plan.cache_info().hits, kind="counter",
+))
+register(Callback("nlquery_fleet_status_sensors", "Topics in the last-seen registry.", lambda: len(fleet_registry)))
+register(Callback(
+    "nlquery_fleet_status_refreshes_total", "Grouped last() refreshes of the last-seen registry.",
+    lambda: fleet_registry.refreshes, kind="counter",
+))
+register(Callback(
+    "nlquery_rollup_lag_seconds", "Age of the newest materialized rollup hour (-1 before the first pass).",
+    materializer.lag_seconds,
+))
+register(Callback("nlquery_ready", "1 once the worker's warm-up has finished (GET /ready).", lambda: int(warmup.ready)))
+register(Callback("nlquery_alert_subscribers", "Open /alerts subscriptions.", lambda: len(alert_monitor.subscribers)))
+register(Callback(
+    "nlquery_alert_polls_total", "Incremental polls of the shared alert monitor.",
+    lambda: alert_monitor.polls, kind="counter",
+))
+register(Callback(
+    "nlquery_alerts_published_total", "Alerts raised or cleared by the alert monitor.",
+    lambda: alert_monitor.published, kind="counter",
+))
+register(Callback("nlquery_admission_in_flight", "Requests holding an admission slot.", lambda: admission.in_flight))
+register(Callback("nlquery_admission_queued", "Requests waiting for an admission slot.", lambda: admission.queued))
+register(Callback(
+    "nlquery_admission_rejected_total", "Requests rejected with 503 by admission control.",
+    lambda: admission.rejected, kind="counter",
+))
+for _name, _flight in [("request", request_flight), ("fetch", fetch_flight), ("rewrite", rewrite_flight)]:
+    register(Callback(
+        f"nlquery_singleflight_{_name}_shared_total", f"Callers that joined an in-flight {_name}.",
+        lambda flight=_flight: flight.shared, kind="counter",
+    ))
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """Request latency histogram plus an optional per-stage Server-Timing header."""
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        elapsed, path=getattr(route, "path", "unmatched"), status=response.status_code
+    )
+
+    if SERVER_TIMING_ENABLED:
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request, stage, cache and Grafana metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
 @app.get("/ping")
 def ping():
     return {"pong": True}
 
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the worker's warm-up (pooled connections, OpenAI client) has finished."""
+    status = warmup.status()
+    if not status["ready"]:
+        return FastJSONResponse(status, status_code=503)
+    return status
+
+
 @app.get("/")
 def root():
     return {"status": "Smart Factory API running"}
 
 
-@app.post("/nl-query")
-def nl_query(req: dict):
+def request_timeout(req: dict, limit: float = REQUEST_DEADLINE_SECONDS) -> float:
+    """Time budget of a request: body "timeout" (seconds), at most limit."""
+    timeout = req.get("timeout")
+    if timeout is None:
+        return limit
+    timeout = float(timeout)
+    if timeout <= 0:
+        raise ValueError("timeout must be positive")
+    return min(timeout, limit)
+
+
+def int_option(req: dict, name: str, minimum: int = 1):
+    """Optional integer option of a request; None when absent, ValueError when invalid or below minimum."""
+    value = req.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+def overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def admit_stream(timeout: float) -> AsyncExitStack:
+    """
+    Admission slot for a streamed response, taken before the response starts
+    (a queued request waits no longer than its deadline) and held until the
+    returned stack is closed. Raises HTTPException 503 when saturated.
+    """
+    slot = AsyncExitStack()
+    try:
+        with deadline_scope(timeout):
+            await slot.enter_async_context(admission.slot())
+    except Overloaded as oe:
+        raise overloaded(oe)
+    return slot
+
+
+def bad_gateway(e: GrafanaError) -> HTTPException:
+    logging.warning("Grafana error: %s", e)
+    return HTTPException(status_code=502, detail=str(e))
+
+
+async def answer_nl_query(req: dict, request: Request, revalidate: bool = False) -> Response:
+    """
+    Shared /nl-query handler. With revalidate (GET), the answer carries an
+    ETag and Cache-Control derived from the resolved plan before anything is
+    fetched, and a matching If-None-Match gets 304 without running the query.
+    Degraded answers and cache=false requests are never cacheable.
+    """
     try:
         query = req.get("query", "")
+        client = request.app.state.grafana_client
+        max_points = int_option(req, "max_points", minimum=3)  # LTTB keeps first and last
+        use_cache = req.get("cache")
 
-        # ---------------- Parse NL query ----------------
-        start, end, fields, tags = parse_nl_query(query)
-
-        all_points = []
-        reasoning_report = {}
-
-        # ---------------- Process each sensor ----------------
-        for field in fields:
-            if field not in SENSOR_CONFIG:
-                continue
-
-            cfg = SENSOR_CONFIG[field]
-
-            flux = build_flux(
-                start=start,
-                end=end,
-                topics=cfg.get("topics"),
-                measurement=cfg["measurement"]
-            )
-
-            payload = {
-                "queries": [
-                    {
-                        "refId": "A",
-                        "datasource": {
-                            "type": "influxdb",
-                            "uid": INFLUX_DATASOURCE_UID
-                        },
-                        "queryType": "flux",
-                        "rawQuery": True,
-                        "query": flux
-                    }
-                ]
-            }
-
-            r = requests.post(
-                f"https://{GRAFANA_HOST}/api/ds/query",
-                headers={
-                    "Authorization": f"Bearer {GRAFANA_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-                verify=False,
-                timeout=15,
-                proxies={"http": None, "https": None},
-            )
-
-            points = extract_points(r.json(), field)
-
-            # ---------------- Filter points based on query condition ----------------
-            numeric_values = []
-            filtered_points = []
-
-            if cfg["measurement"] != "sensor_status":
-                # identify threshold conditions from query
-                matches = re.findall(r"(below|under|less than|above|over|greater than)\s*(-?\d+\.?\d*)", query.lower())
-                for p in points:
-                    val = p.get("value")
-                    try:
-                        val_float = float(val)
-                    except (TypeError, ValueError):
-                        continue
-
-                    keep = True
-                    for comparator, threshold in matches:
-                        threshold = float(threshold)
-                        if comparator in ["below", "under", "less than"]:
-                            if val_float >= threshold:
-                                keep = False
-                        elif comparator in ["above", "over", "greater than"]:
-                            if val_float <= threshold:
-                                keep = False
-                    if keep:
-                        filtered_points.append(p)
-                        numeric_values.append(val_float)
-                points = filtered_points
-            else:
-                # For status, keep all points as is
-                numeric_values = []
-
-            all_points.extend(points)
-
-            # ---------------- Compute stats ----------------
-            if cfg["measurement"] == "sensor_status":
-                stats = {"min_value": None, "max_value": None, "avg_value": None, "count": len(points)}
-            else:
-                stats = {
-                    "min_value": min(numeric_values) if numeric_values else None,
-                    "max_value": max(numeric_values) if numeric_values else None,
-                    "avg_value": sum(numeric_values) / len(numeric_values) if numeric_values else None,
-                    "count": len(numeric_values)
-                }
-
-            # ---------------- Reasoning ----------------
-            reasoning_cfg = cfg.get("reasoning", {})
-            reasoning_parts = []
-
-            if cfg["measurement"] == "sensor_status":
-                if not points and reasoning_cfg.get("check_missing", False):
-                    reasoning_parts.append(f"No status data recorded for '{field}' yesterday.")
-                elif points:
-                    last_val = str(points[-1].get("value")).lower()
-                    reasoning_parts.append(
-                        f"The sensor is currently {STATUS_MAP.get(last_val, last_val.upper())}."
-                    )
-            else:
-                if stats["count"] == 0:
-                    reasoning_parts.append(f"No {field} readings match your query condition.")
-                else:
-                    if reasoning_cfg.get("check_constant", False) and stats["min_value"] == stats["max_value"]:
-                        reasoning_parts.append(
-                            f"Sensor value constant at {stats['min_value']:.2f}; may indicate a malfunction or lack of change."
-                        )
-                    if stats["count"] > 1 and len(numeric_values) > 1:
-                        delta = stats["max_value"] - stats["min_value"]
-                        if delta < 0.1 * abs(stats['avg_value'] or 1):
-                            reasoning_parts.append(
-                                "The readings show minimal fluctuation, indicating stable measurements."
-                            )
-
-                    unit = cfg.get("unit", "")
-                    reasoning_parts.append(
-                        f"The {field} was usually around {stats['avg_value']:.2f}{unit}, "
-                        f"going as low as {stats['min_value']:.2f}{unit} and as high as {stats['max_value']:.2f}{unit}."
+        with deadline_scope(request_timeout(req)):
+            if req.get("cursor"):
+                async with admission.slot():
+                    page = await page_nl_query(
+                        client,
+                        query,
+                        req["cursor"],
+                        page_size=int_option(req, "page_size") or max_points or COMPACT_PAGE_SIZE,
+                        use_cache=use_cache,
                     )
+                return await json_response(request, page)
+
+            stats_only = req.get("stats_only")
+            defer_summary = bool(req.get("defer_summary"))
+            response_format = req.get("format", "full")
+            prepared = prepare_query(query, stats_only)
+
+            etag, cache_control = None, "no-store"
+            if revalidate and (CACHE_ENABLED if use_cache is None else use_cache):
+                etag, cache_control = answer_validator(
+                    prepared, (stats_only, defer_summary, response_format, max_points)
+                )
+                if etag_matches(request.headers.get("if-none-match"), etag):
+                    return not_modified(etag, cache_control)
+
+            async with admission.slot():
+                result = await run_nl_query(
+                    client,
+                    query,
+                    batch=req.get("batch"),
+                    stats_only=stats_only,
+                    use_cache=use_cache,
+                    defer_summary=defer_summary,
+                    response_format=response_format,
+                    max_points=max_points,
+                    prepared=prepared,
+                )
 
-                    expected = reasoning_cfg.get("expected_range")
-                    if expected and stats["min_value"] is not None:
-                        if stats["min_value"] < expected[0] or stats["max_value"] > expected[1]:
-                            reasoning_parts.append(
-                                f"These readings are outside the expected range ({expected[0]}–{expected[1]})."
-                            )
-                        else:
-                            reasoning_parts.append(
-                                f"These readings are within the expected operational range ({expected[0]}–{expected[1]})."
-                            )
-
-            reasoning_report[field] = " ".join(reasoning_parts)
-
-        # ---------------- Inject reasoning into sample points ----------------
-        for p in all_points:
-            field = p.get("field")
-            if field in reasoning_report:
-                p["reasoning"] = reasoning_report[field]
-
-        # ---------------- Compute summary ----------------
-        summary = compute_summary(all_points, reasoning_report=reasoning_report)
-        for field, text in reasoning_report.items():
-            summary += f"\n{field} reasoning: {text}"
-
-        return {
-            "query": query,
-            "summary": summary,
-            "sample_points": all_points,
-            "reasoning": reasoning_report
-        }
+        if not revalidate:
+            return await json_response(request, result)
+        if "degraded" in result:
+            etag, cache_control = None, "no-store"
+        headers = {"Cache-Control": cache_control}
+        if etag:
+            headers["ETag"] = etag
+        return await json_response(request, result, headers=headers)
 
     except HTTPException as he:
         raise he
+    except Overloaded as oe:
+        raise overloaded(oe)
+    except TimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except GrafanaError as ge:
+        raise bad_gateway(ge)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         logging.exception("Error in /nl-query")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/nl-query")
+async def nl_query(req: dict, request: Request):
+    """
+    Answer a natural-language sensor question.
+    Optional body keys: batch, stats_only, cache, defer_summary,
+    format ("full" | "compact"), max_points (LTTB), cursor / page_size (raw pages),
+    timeout (seconds; fields not fetched by then come back marked "degraded").
+    Responds 503 with Retry-After when admission control is saturated, and
+    502 when Grafana fails (5xx or a body that is not JSON).
+    Large answers are gzip / brotli compressed per Accept-Encoding.
+    """
+    return await answer_nl_query(req, request)
+
+
+@app.get("/nl-query")
+async def nl_query_get(
+    request: Request,
+    query: str = "",
+    batch: bool = None,
+    stats_only: bool = None,
+    cache: bool = None,
+    defer_summary: bool = False,
+    format: str = "full",
+    max_points: int = None,
+    cursor: str = None,
+    page_size: int = None,
+    timeout: float = None,
+):
+    """
+    Same as POST /nl-query with the options as query parameters, for HTTP
+    caches: answers carry an ETag and Cache-Control (closed ranges such as
+    "yesterday" are immutable, open ranges fresh for CACHE_TTL_SECONDS) and
+    If-None-Match revalidation returns 304 without querying Grafana.
+    """
+    req = {
+        "query": query,
+        "batch": batch,
+        "stats_only": stats_only,
+        "cache": cache,
+        "defer_summary": defer_summary,
+        "format": format,
+        "max_points": max_points,
+        "cursor": cursor,
+        "page_size": page_size,
+        "timeout": timeout,
+    }
+    return await answer_nl_query(req, request, revalidate=True)
+
+
+@app.post("/nl-query/batch")
+async def nl_query_batch(req: dict, request: Request):
+    """
+    Answer many questions at once (e.g. a shift report). Their fetches are
+    planned together, so overlapping ranges are pulled from Grafana once.
+    Body: queries (list of questions) plus the /nl-query options batch,
+    stats_only, cache, defer_summary, format, max_points, timeout for all of them.
+    """
+    queries = req.get("queries")
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list of strings")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"at most {BATCH_MAX_QUERIES} queries per batch")
+
+    try:
+        max_points = int_option(req, "max_points", minimum=3)
+        with deadline_scope(request_timeout(req)):
+            async with admission.slot():
+                results = await run_nl_batch(
+                    request.app.state.grafana_client,
+                    queries,
+                    batch=req.get("batch"),
+                    stats_only=req.get("stats_only"),
+                    use_cache=req.get("cache"),
+                    defer_summary=bool(req.get("defer_summary")),
+                    response_format=req.get("format", "full"),
+                    max_points=max_points,
+                )
+        return await json_response(request, {"results": results})
+
+    except Overloaded as oe:
+        raise overloaded(oe)
+    except TimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except GrafanaError as ge:
+        raise bad_gateway(ge)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logging.exception("Error in /nl-query/batch")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/nl-query/stream")
+async def nl_query_stream(req: dict, request: Request):
+    """
+    Same answer as /nl-query, streamed field by field as NDJSON
+    (or as Server-Sent Events when the client accepts text/event-stream).
+    Admission and the deadline (body "timeout") apply as for /nl-query: the
+    slot is taken before the response starts and held until the stream ends;
+    fields not fetched in time come back with "degraded": true.
+    """
+    query = req.get("query", "")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    try:
+        timeout = request_timeout(req)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    started = time.monotonic()
+    slot = await admit_stream(timeout)
+
+    def encode(event):
+        line = json.dumps(event, ensure_ascii=False)
+        return f"data: {line}\n\n" if sse else line + "\n"
+
+    async def events():
+        try:
+            with deadline_scope(max(0.0, timeout - (time.monotonic() - started))):
+                async for event in stream_nl_query(
+                    request.app.state.grafana_client,
+                    query,
+                    stats_only=req.get("stats_only"),
+                    use_cache=req.get("cache"),
+                    defer_summary=bool(req.get("defer_summary")),
+                ):
+                    yield encode(event)
+        except Exception as e:
+            logging.exception("Error in /nl-query/stream")
+            yield encode({"type": "error", "detail": str(e)})
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        background=BackgroundTask(slot.aclose),  # releases the slot if the stream never started
+    )
+
+
+@app.websocket("/alerts/ws")
+async def alerts_ws(websocket: WebSocket, fields: str = None):
+    """
+    Live alerts as JSON messages: a "snapshot" of the alerts currently
+    raised, then "alert" events as checks flip (out_of_range / back_in_range,
+    constant / varying, offline / online) and periodic heartbeats.
+    fields: optional comma-separated sensor filter.
+    """
+    try:
+        wanted = parse_alert_fields(fields)
+    except ValueError as ve:
+        await websocket.close(code=1008, reason=str(ve))
+        return
+
+    await websocket.accept()
+    sub = alert_monitor.subscribe(websocket.app.state.grafana_client, wanted)
+    try:
+        while True:
+            await websocket.send_text(json.dumps(await sub.get(), ensure_ascii=False))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        alert_monitor.unsubscribe(sub)
+
+
+@app.get("/alerts/stream")
+async def alerts_stream(request: Request, fields: str = None):
+    """Same events as /alerts/ws, as Server-Sent Events."""
+    try:
+        wanted = parse_alert_fields(fields)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    sub = alert_monitor.subscribe(request.app.state.grafana_client, wanted)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                event = await sub.get()
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            alert_monitor.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+    "xlsx": (export_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+@app.post("/export")
+async def export(req: dict, request: Request):
+    """
+    Full sensor history for a question as CSV (streamed as it is fetched) or
+    XLSX (one sheet per field plus a Summary sheet), in day-sized pages.
+    Body: query, format ("csv" | "xlsx"), every (optional window, e.g. "1m"),
+    timeout (seconds, at most EXPORT_DEADLINE_SECONDS).
+    An XLSX workbook is only complete once written, so it is built in a
+    temporary file and no bytes are sent until every page has been fetched;
+    CSV starts downloading right away. Admission applies as for /nl-query:
+    the slot is held until the download ends.
+    """
+    query = req.get("query", "")
+    fmt = req.get("format", "csv")
+    every = req.get("every")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if every is not None and every not in WINDOW_SECONDS:
+        raise HTTPException(status_code=400, detail=f"every must be one of {', '.join(WINDOW_SECONDS)}")
+    try:
+        timeout = request_timeout(req, EXPORT_DEADLINE_SECONDS)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    build, media_type = EXPORT_FORMATS[fmt]
+    started = time.monotonic()
+    slot = await admit_stream(timeout)
+
+    async def body():
+        try:
+            with deadline_scope(max(0.0, timeout - (time.monotonic() - started))):
+                async for chunk in build(request.app.state.grafana_client, query, every):
+                    yield chunk
+        except Exception as e:
+            logging.exception("Error in /export")
+            if fmt == "csv":
+                yield f"\n# error: {e}\n"
+            raise
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sensor-export.{fmt}"'},
+        background=BackgroundTask(slot.aclose),  # releases the slot if the download never started
+    )
+
+
+@app.get("/summary/{summary_id}")
+def summary_rewrite(summary_id: str):
+    """LLM rewrite of a deferred /nl-query summary, once it has finished."""
+    status, summary = get_rewrite(summary_id)
+    if status == "unavailable":
+        raise HTTPException(status_code=404, detail="Unknown or expired summary_id")
+    return {"summary_id": summary_id, "status": status, "summary": summary}
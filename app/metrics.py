@@ -0,0 +1,159 @@
+# metrics.py
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; spans sub-ms parsing up to the 15s Grafana timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+# Per-request stage durations for the Server-Timing header (set by the middleware)
+request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_label_str(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            state = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for key, state in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_label_str(names, key + (bound,))} {count}"
+            yield f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {state[-1]}"
+            yield f"{self.name}_sum{_label_str(self.labelnames, key)} {state[-2]}"
+            yield f"{self.name}_count{_label_str(self.labelnames, key)} {state[-1]}"
+
+
+class Callback:
+    """Value read from a callback at scrape time (cache sizes, in-flight counts)."""
+
+    def __init__(self, name: str, documentation: str, fn, kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {self.fn()}"
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition format for every registered metric."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- /nl-query metrics ----------------
+
+REQUEST_SECONDS = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ["path", "status"]
+))
+STAGE_SECONDS = register(Histogram(
+    "nlquery_stage_duration_seconds", "Time spent per /nl-query pipeline stage.", ["stage"]
+))
+POINTS_FETCHED = register(Counter(
+    "nlquery_points_fetched_total", "Points parsed from Grafana responses.", ["field"]
+))
+POINTS_RETURNED = register(Counter(
+    "nlquery_points_returned_total", "Sample points returned to clients.", ["field"]
+))
+BYTES_RECEIVED = register(Counter(
+    "grafana_response_bytes_total", "Response body bytes received from /api/ds/query."
+))
+GRAFANA_REQUESTS = register(Counter(
+    "grafana_requests_total", "Requests sent to /api/ds/query.", ["status"]
+))
+CACHE_LOOKUPS = register(Counter(
+    "nlquery_cache_lookups_total", "Cache lookups by cache and result.", ["cache", "result"]
+))
+DEGRADED_RESPONSES = register(Counter(
+    "nlquery_degraded_responses_total", "Answers returned partial or without the LLM rewrite.", ["reason"]
+))
+BATCH_PLANS = register(Counter(
+    "nlquery_batch_plans_total", "Field plans of batched questions, fetched or shared with another question.", ["result"]
+))
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block into nlquery_stage_duration_seconds and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings: dict) -> str:
+    """{"grafana": 0.1204} -> 'grafana;dur=120.4'"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
@@ -1,30 +1,136 @@
 import datetime
 import re
+from functools import lru_cache
+from typing import NamedTuple
 from app.sensor import SENSOR_CONFIG
+from app.config import QUERY_PLAN_CACHE_SIZE
 
+BELOW_WORDS = ("below", "under", "less than")
 
-def parse_nl_query(query: str):
-    q = query.lower()
-    now = datetime.datetime.utcnow()
+AGGREGATION_WORDS = {
+    "min": ("min", "minimum", "lowest"),
+    "max": ("max", "maximum", "highest", "peak"),
+    "mean": ("avg", "average", "mean"),
+    "p50": ("median",),
+}
+AGGREGATION_FNS = {word: fn for fn, words in AGGREGATION_WORDS.items() for word in words}
+
+
+def aggregation_order(fn: str) -> tuple:
+    """min, max, mean first, then percentiles ("p50", "p95", ...) by level."""
+    if fn in ("min", "max", "mean"):
+        return 0, list(AGGREGATION_WORDS).index(fn)
+    return 1, int(fn[1:])
+
+
+def _words(words) -> str:
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+# Everything the planner looks for, in one precompiled alternation scanned once per question
+MATCHER = re.compile(
+    rf"(?P<scope>\b(?:from|at|on|in) (?P<scope_kind>device|site|line) (?P<scope_value>[\w-]+))"
+    rf"|(?P<last>last (?P<last_n>\d+) (?P<last_unit>hour|day|week)s?)"
+    rf"|(?P<day>today|yesterday)"
+    rf"|(?P<threshold>below|under|less than|above|over|greater than)\s*(?P<threshold_value>-?\d+\.?\d*)"
+    rf"|\b(?P<aggregation>{_words(AGGREGATION_FNS)})\b"
+    rf"|\b(?:p(?P<pct>\d{{1,2}})|(?P<pct_ord>\d{{1,2}})(?:st|nd|rd|th)? percentile)\b"
+    rf"|\b(?P<fleet>sensors|devices|fleet|all)\b"
+    rf"|(?P<sensor>{_words(SENSOR_CONFIG)})"
+    rf"|(?P<presence>online|offline)"
+)
+
+
+class QueryPlan(NamedTuple):
+    """
+    Parsed, hashable form of a question. Time is kept relative (time_spec)
+    and resolved against "now" per request by resolve_time().
+    """
+    fields: tuple
+    time_spec: tuple  # (day: None | "today" | "yesterday", last: None | (n, "hour" | "day" | "week"))
+    thresholds: tuple  # (("<" | ">", value), ...)
+    aggregations: tuple  # subset of ("min", "max", "mean"), then percentiles ("p50", "p95", ...)
+    tags: tuple  # sorted ((device | site | line, value), ...)
+    fleet: bool  # status question about every sensor
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def plan_query(query: str) -> QueryPlan:
+    """QueryPlan for a question; memoized per normalized text."""
+    return compile_plan(normalize_query(query))
+
+
+@lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def compile_plan(q: str) -> QueryPlan:
+    found = set()
+    day = last = None
+    thresholds = []
+    aggregations = set()
+    tags = {}
+    fleet_words = status_words = False
+
+    for m in MATCHER.finditer(q):
+        if m.group("scope"):
+            tags[m.group("scope_kind")] = m.group("scope_value")
+        elif m.group("last"):
+            last = last or (int(m.group("last_n")), m.group("last_unit"))
+        elif m.group("day"):
+            # "today" wins over "yesterday" when both appear
+            day = "today" if "today" in (day, m.group("day")) else "yesterday"
+        elif m.group("threshold"):
+            op = "<" if m.group("threshold") in BELOW_WORDS else ">"
+            thresholds.append((op, float(m.group("threshold_value"))))
+        elif m.group("aggregation"):
+            aggregations.add(AGGREGATION_FNS[m.group("aggregation")])
+        elif m.group("pct") or m.group("pct_ord"):
+            aggregations.add(f"p{int(m.group('pct') or m.group('pct_ord'))}")
+        elif m.group("fleet"):
+            fleet_words = True
+        elif m.group("sensor"):
+            found.add(m.group("sensor"))
+            status_words = status_words or m.group("sensor") == "status"
+        elif m.group("presence"):
+            status_words = True
+
+    fields = [k for k in SENSOR_CONFIG if k in found]
+    fleet = status_words and fleet_words and fields in ([], ["status"])
+    if fleet:
+        fields = ["status"]
+
+    return QueryPlan(
+        fields=tuple(fields),
+        time_spec=(day, last),
+        thresholds=tuple(thresholds),
+        aggregations=tuple(sorted(aggregations, key=aggregation_order)),
+        tags=tuple(sorted(tags.items())),
+        fleet=fleet,
+    )
+
+
+def resolve_time(time_spec: tuple, now: datetime.datetime = None):
+    """(day, last) time spec -> (start, end) naive UTC datetimes."""
+    day, last = time_spec
+    now = now or datetime.datetime.utcnow()
 
     # ---------------- Time detection ----------------
     start = now - datetime.timedelta(days=2)
     end = now
 
-    if "today" in q:
+    if day == "today":
         start = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
-    elif "yesterday" in q:
+    elif day == "yesterday":
         start = (now - datetime.timedelta(days=1)).replace(
             hour=0, minute=0, second=0, microsecond=0
         )
         end = start + datetime.timedelta(days=1)
 
     # last N hours / days / weeks
-    m = re.search(r"last (\d+) (hour|day|week)s?", q)
-    if m:
-        n = int(m.group(1))
-        unit = m.group(2)
+    if last:
+        n, unit = last
         if unit == "hour":
             start = now - datetime.timedelta(hours=n)
         elif unit == "day":
@@ -32,14 +138,27 @@ def parse_nl_query(query: str):
         elif unit == "week":
             start = now - datetime.timedelta(weeks=n)
 
-    # ---------------- Sensor detection ----------------
-    fields = [k for k in SENSOR_CONFIG if k in q]
+    return start, end
+
+
+def parse_nl_query(query: str):
+    plan = plan_query(query)
+    start, end = resolve_time(plan.time_spec)
+    return start, end, list(plan.fields), dict(plan.tags)
+
+
+def parse_thresholds(query: str):
+    """
+    "below 20 and above 5" -> [("<", 20.0), (">", 5.0)]
+    """
+    return list(plan_query(query).thresholds)
+
 
-    if "status" in q and "status" not in fields:
-        fields.append("status")
+def parse_aggregations(query: str):
+    """Aggregation intent of the question, e.g. "Maximum humidity" -> ["max"]."""
+    return list(plan_query(query).aggregations)
 
-    # ---------------- Device detection ----------------
-    device_match = re.search(r"from device (\w+)", q)
-    tags = {"device": device_match.group(1)} if device_match else {}
 
-    return start, end, fields, tags
+def parse_fleet_status(query: str) -> bool:
+    """Status question about the whole fleet rather than one sensor."""
+    return plan_query(query).fleet
@@ -0,0 +1,1052 @@
+# pipeline.py
+import asyncio
+import base64
+import datetime
+import json
+from app.nlp_parser import plan_query, resolve_time
+from app.flux_builder import build_flux, build_stats_flux, plan_window, window_fn, split_topics, WINDOW_SECONDS
+from app.data_parser import extract_series, extract_stats, merge_stats, series_to_points, OFFLINE_THRESHOLD_SECONDS
+from app.series import series_stats, to_epoch_seconds
+from app.stats import percentile_names, EMPTY_STATS
+from app.deadline import budget, remaining
+from app.grafana import query_grafana_batch, result_error
+from app.cache import query_cache, align_range, slice_series
+from app.singleflight import fetch_flight, request_flight
+from app.topics import topic_registry
+from app.rollups import materializer
+from app.fleet import fleet_registry, fleet_counts, fleet_reasoning, last_seen_iso
+from app.metrics import timed, POINTS_FETCHED, POINTS_RETURNED, CACHE_LOOKUPS, BATCH_PLANS, DEGRADED_RESPONSES
+from app.summary import compute_summary, summary_template, start_rewrite
+from app.sensor import SENSOR_CONFIG, STATUS_MAP
+from app.config import (
+    GRAFANA_MAX_CONCURRENCY,
+    GRAFANA_BATCH_QUERIES,
+    CACHE_ENABLED,
+    CACHE_ALIGN_SECONDS,
+    STREAM_CHUNK_POINTS,
+    SUMMARY_TIMEOUT_SECONDS,
+    REQUEST_SUMMARY_SHARE,
+)
+
+
+def is_status(cfg):
+    return cfg["measurement"] in ["status", "sensor_status"]
+
+
+def use_stats_plan(cfg, aggregations, stats_only=None):
+    """
+    Stats-only plan: min/max/avg questions on numeric sensors are answered
+    with scalars reduced inside Influx instead of pulling every window.
+    Percentiles need the readings, so those questions fetch the series.
+    stats_only overrides the intent detection when set explicitly.
+    """
+    if is_status(cfg):
+        return False
+    if stats_only is None:
+        return bool(aggregations) and not percentile_names(aggregations)
+    return bool(stats_only)
+
+
+def plan_field(field, start, end, stats_plan=False, thresholds=(), aggregations=(), tags=None) -> dict:
+    """
+    Fetch plan for one field: topics (narrowed by device / site / line tags),
+    cache key, bucket-aligned range and a Flux builder for any sub-range of
+    it. The builder returns one query per FLUX_TOPICS_PER_QUERY topics.
+    - "stats": stats-only reductions, cached per aligned range; without
+      thresholds the whole hours come from the rollup store
+    - "last": status last(), cached per aligned range
+    - "range": windowed series, cached per key and extended by tail fetches
+    """
+    cfg = SENSOR_CONFIG[field]
+    topics = topic_registry.lookup(field, **(tags or {}))
+    chunks = split_topics(topics)
+
+    if stats_plan:
+        s, e = align_range(start, end, CACHE_ALIGN_SECONDS)
+        return {
+            "kind": "stats",
+            "field": field,
+            "topics": topics,
+            "key": ("stats", topics, tuple(thresholds)),
+            "start": s,
+            "end": e,
+            "rollup": not thresholds,
+            "flux": lambda fs, fe=e: [build_stats_flux(fs, fe, chunk, thresholds) for chunk in chunks],
+        }
+
+    if is_status(cfg):
+        s, e = align_range(start, end, CACHE_ALIGN_SECONDS)
+        return {
+            "kind": "last",
+            "field": field,
+            "topics": topics,
+            "key": ("last", topics),
+            "start": s,
+            "end": e,
+            "flux": lambda fs, fe=e: [
+                build_flux(start=fs, end=fe, topics=chunk, measurement=cfg["measurement"]) for chunk in chunks
+            ],
+        }
+
+    every = plan_window(start, end)
+    fn = window_fn(aggregations)
+    bucket = max(WINDOW_SECONDS[every], CACHE_ALIGN_SECONDS)
+    s, e = align_range(start, end, bucket)
+    return {
+        "kind": "range",
+        "field": field,
+        "topics": topics,
+        "key": ("series", topics, cfg["measurement"], every, fn),
+        "start": s,
+        "end": e,
+        "every": every,
+        "bucket": datetime.timedelta(seconds=bucket),
+        "flux": lambda fs, fe=e: [
+            build_flux(start=fs, end=fe, topics=chunk, measurement=cfg["measurement"], every=every, fn=fn)
+            for chunk in chunks
+        ],
+    }
+
+
+async def load_fields(
+    client,
+    plans: dict,
+    batch: bool,
+    use_cache: bool = CACHE_ENABLED,
+    semaphore: asyncio.Semaphore = None,
+    timeout: float = None,
+) -> dict:
+    """
+    Resolve every field plan through query_cache, fetching from Grafana only
+    what is missing. Identical fetches already in flight for another request
+    are joined instead of repeated (fetch_flight).
+    plans are keyed by field, or by any other name (also used as the Grafana
+    refId) when one request loads several plans of the same field.
+    timeout: return after this many seconds with whatever has loaded (one
+    fetch per field unless batch); fields still fetching, or whose fetch
+    timed out, are left out. Fetches that are still running finish in the
+    background and fill the cache, within the request deadline.
+    Returns {name: stats dict | list of Series}.
+    """
+    loaded = {}
+    fetch_from = {}  # field -> fetch start
+    tails = {}
+
+    # ---------------- Cache lookups ----------------
+    for field, plan in plans.items():
+        key, s, e = plan["key"], plan["start"], plan["end"]
+
+        if not plan["topics"]:
+            # tags matched no topic of this sensor: nothing to ask Influx
+            loaded[field] = extract_stats({}) if plan["kind"] == "stats" else []
+        elif not use_cache:
+            fetch_from[field] = s
+        elif plan["kind"] == "range":
+            state, value = query_cache.lookup_range(key, s, e, overlap=plan["bucket"])
+            CACHE_LOOKUPS.inc(cache="query", result=state)
+            if state == "hit":
+                loaded[field] = value
+            elif state == "tail":
+                tails[field] = value
+                fetch_from[field] = value[0]
+            else:
+                fetch_from[field] = s
+        else:
+            cached = query_cache.get(key, s, e)
+            CACHE_LOOKUPS.inc(cache="query", result="miss" if cached is None else "hit")
+            if cached is not None:
+                loaded[field] = cached
+            else:
+                fetch_from[field] = s
+
+    # ---------------- Join identical in-flight fetches ----------------
+    flight_keys = {field: flight_key(plans[field], since, use_cache) for field, since in fetch_from.items()}
+    joined = {}
+    for field, key in flight_keys.items():
+        fut = fetch_flight.get(key)
+        if fut is not None:
+            joined[field] = fut
+            fetch_flight.shared += 1
+            del fetch_from[field]
+
+    # ---------------- Fetch what is missing ----------------
+    waits = []
+    if fetch_from:
+        if batch:
+            groups = [fetch_from]
+        else:
+            groups = [{field: since} for field, since in fetch_from.items()]
+            semaphore = semaphore or asyncio.Semaphore(GRAFANA_MAX_CONCURRENCY)
+        for group in groups:
+            task = asyncio.ensure_future(
+                fetch_and_store(client, plans, group, tails, batch, use_cache, semaphore)
+            )
+            publish_field_futures(task, {field: flight_keys[field] for field in group})
+            waits.append(task)
+    # a joined fetch may have been published under another request's plan name
+    for field, fut in joined.items():
+        refetch = lambda group={field: flight_keys[field][2]}: fetch_and_store(
+            client, plans, group, tails, batch, use_cache, semaphore
+        )
+        task = asyncio.ensure_future(join_as(field, fut, refetch))
+        task.add_done_callback(retrieve_exception)  # its shield may be cancelled on timeout
+        waits.append(task)
+    waits = [asyncio.shield(w) for w in waits]
+
+    if timeout is None:
+        for value in await asyncio.gather(*waits):
+            loaded.update(value)
+        return loaded
+
+    done, pending = await asyncio.wait(waits, timeout=timeout) if waits else (set(), set())
+    for fut in pending:
+        fut.cancel()  # only the shield: the fetch itself runs on
+    for fut in done:
+        try:
+            loaded.update(fut.result())
+        except TimeoutError:
+            pass
+    return loaded
+
+
+def flight_key(plan: dict, since, use_cache: bool) -> tuple:
+    """
+    fetch_flight key of a plan fetched from since: two requests share a fetch
+    only when the cached range (start, end), the fetch start and the cache
+    mode all match; a tail fetch is merged into its own request's range.
+    """
+    return plan["key"], plan["start"], since, plan["end"], use_cache
+
+
+async def join_as(name: str, fut: asyncio.Future, refetch) -> dict:
+    """
+    {name: value} of a joined fetch_flight future. The fetch runs under the
+    deadline of the request that started it; if that one ran out while this
+    request still has time, refetch() for this request instead.
+    """
+    try:
+        return {name: await fut}
+    except TimeoutError:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise
+        return await refetch()
+
+
+def retrieve_exception(fut: asyncio.Future):
+    """Done-callback: mark a failure as retrieved, so abandoned tasks aren't logged as "never retrieved"."""
+    if not fut.cancelled():
+        fut.exception()
+
+
+def publish_field_futures(task: asyncio.Future, flight_keys: dict):
+    """Expose each field of a running fetch task under its fetch_flight key; the futures resolve to the bare value."""
+    loop = asyncio.get_running_loop()
+    futures = {field: fetch_flight.share(key, loop.create_future()) for field, key in flight_keys.items()}
+
+    def resolve(done):
+        for field, fut in futures.items():
+            if fut.done():
+                continue
+            if done.cancelled():
+                fut.cancel()
+            elif done.exception() is not None:
+                fut.set_exception(done.exception())
+            else:
+                fut.set_result(done.result()[field])
+
+    task.add_done_callback(resolve)
+
+
+async def fetch_and_store(client, plans, fetch_from, tails, batch, use_cache, semaphore=None) -> dict:
+    """
+    Fetch fields from Grafana (each from its own start), parse and update query_cache.
+    Stats plans covered by the rollup store only fetch their partial-hour head and tail.
+    """
+    fluxes = {}
+    rolled = {}  # field -> stats of the rollup-covered hours
+    for field, since in fetch_from.items():
+        plan = plans[field]
+        covered = await materializer.cover(plan, since)
+        with timed("build_flux"):
+            if covered is None:
+                fluxes[field] = plan["flux"](since)
+            else:
+                cs, ce, rolled[field] = covered
+                fluxes[field] = (plan["flux"](since, cs) if since < cs else []) + (
+                    plan["flux"](ce) if ce < plan["end"] else []
+                )
+    responses = await fetch_responses(client, fluxes, batch, semaphore)
+
+    loaded = {}
+    for field, (resp, ref_id) in responses.items():
+        plan = plans[field]
+        key, s, e = plan["key"], plan["start"], plan["end"]
+        cacheable = use_cache and result_error(resp, ref_id) is None
+
+        with timed("extract_points"):
+            if plan["kind"] == "stats":
+                value = extract_stats(resp, ref_id=ref_id)
+                if field in rolled:
+                    value = merge_stats(rolled[field], value)
+            else:
+                value = extract_series(resp, plan["field"], ref_id=ref_id)
+                POINTS_FETCHED.inc(sum(len(series) for series in value), field=plan["field"])
+                if plan["kind"] == "last":
+                    fleet_registry.observe({s.topic: to_epoch_seconds(s.values[-1]) for s in value if len(s)})
+
+        if cacheable and field in tails:
+            value = query_cache.extend_range(key, s, e, tails[field], value)
+        elif cacheable and plan["kind"] == "range":
+            query_cache.store_range(key, s, e, value)
+        elif cacheable:
+            query_cache.set(key, s, e, value)
+
+        loaded[field] = value
+
+    return loaded
+
+
+async def fetch_responses(client, fluxes: dict, batch: bool, semaphore: asyncio.Semaphore = None) -> dict:
+    """
+    Run the per-field Flux queries; fluxes maps field -> list of sub-queries
+    (one per topic chunk). Returns {field: (resp, ref_ids)}.
+    batch: one /api/ds/query request for everything, refIds "<field>" or
+    "<field>/<i>", demultiplexed by the parsers; otherwise one concurrent
+    request per sub-query, merged back per field.
+    semaphore: shared fan-out cap (default: a new GRAFANA_MAX_CONCURRENCY one).
+    """
+    if not fluxes:
+        return {}
+
+    ref_fluxes = {}
+    ref_ids = {}
+    for field, queries in fluxes.items():
+        refs = [field] if len(queries) == 1 else [f"{field}/{i}" for i in range(len(queries))]
+        ref_fluxes.update(zip(refs, queries))
+        ref_ids[field] = refs
+
+    if not ref_fluxes:
+        # every field answered without Grafana (e.g. fully rollup-covered)
+        return {field: ({"results": {}}, refs) for field, refs in ref_ids.items()}
+
+    if batch:
+        resp = await query_grafana_batch(client, ref_fluxes)
+        return {field: (resp, refs) for field, refs in ref_ids.items()}
+
+    semaphore = semaphore or asyncio.Semaphore(GRAFANA_MAX_CONCURRENCY)
+
+    async def fetch_one(ref, flux):
+        async with semaphore:
+            return await query_grafana_batch(client, {ref: flux})
+
+    resps = await asyncio.gather(*(fetch_one(ref, flux) for ref, flux in ref_fluxes.items()))
+    results = {}
+    for resp in resps:
+        results.update(resp.get("results", {}))
+    merged = {"results": results}
+    return {field: (merged, refs) for field, refs in ref_ids.items()}
+
+
+def compute_stats(series, cfg, percentiles=()):
+    """One-pass stats over a field's filtered series, with the requested percentiles."""
+    if is_status(cfg):
+        return {"min_value": None, "max_value": None, "avg_value": None, "count": sum(len(s) for s in series)}
+    return series_stats(series, percentiles)
+
+
+def last_status(series):
+    """ONLINE / OFFLINE label of the most recent status reading, None if there is none."""
+    series = [s for s in series if len(s)]
+    if not series:
+        return None
+    return str(series[-1].status_labels(OFFLINE_THRESHOLD_SECONDS)[-1])
+
+
+def build_reasoning(field, cfg, series, stats, window: str = None):
+    """
+    Rule-based explanation of one field's readings.
+    window: aggregateWindow the series were fetched at; percentiles are then
+    over those window averages, not the raw readings, and say so.
+    """
+    reasoning_cfg = cfg.get("reasoning", {})
+    reasoning_parts = []
+
+    if is_status(cfg):
+        status = last_status(series)
+        if status is None and reasoning_cfg.get("check_missing", False):
+            reasoning_parts.append(f"No status data recorded for '{field}' yesterday.")
+        elif status is not None:
+            last_val = status.lower()
+            reasoning_parts.append(
+                f"The sensor is currently {STATUS_MAP.get(last_val, last_val.upper())}."
+            )
+    else:
+        if stats["count"] == 0:
+            reasoning_parts.append(f"No {field} readings match your query condition.")
+        else:
+            if reasoning_cfg.get("check_constant", False) and stats["min_value"] == stats["max_value"]:
+                reasoning_parts.append(
+                    f"Sensor value constant at {stats['min_value']:.2f}; may indicate a malfunction or lack of change."
+                )
+            if stats["count"] > 1:
+                delta = stats["max_value"] - stats["min_value"]
+                if delta < 0.1 * abs(stats['avg_value'] or 1):
+                    reasoning_parts.append(
+                        "The readings show minimal fluctuation, indicating stable measurements."
+                    )
+
+            unit = cfg.get("unit", "")
+            reasoning_parts.append(
+                f"The {field} was usually around {stats['avg_value']:.2f}{unit}, "
+                f"going as low as {stats['min_value']:.2f}{unit} and as high as {stats['max_value']:.2f}{unit}."
+            )
+
+            for key, value in stats.items():
+                if key.startswith("p") and key.endswith("_value") and value is not None:
+                    level = key[1:-len("_value")]
+                    of = f"{window} averages" if window else "readings"
+                    reasoning_parts.append(
+                        f"The median of the {of} was {value:.2f}{unit}." if level == "50"
+                        else f"{level}% of the {of} were at or below {value:.2f}{unit}."
+                    )
+
+            expected = reasoning_cfg.get("expected_range")
+            if expected and stats["min_value"] is not None:
+                if stats["min_value"] < expected[0] or stats["max_value"] > expected[1]:
+                    reasoning_parts.append(
+                        f"These readings are outside the expected range ({expected[0]}–{expected[1]})."
+                    )
+                else:
+                    reasoning_parts.append(
+                        f"These readings are within the expected operational range ({expected[0]}–{expected[1]})."
+                    )
+
+    return " ".join(reasoning_parts)
+
+
+def prepare_query(query: str, stats_only: bool = None, start=None, end=None) -> dict:
+    """
+    Parse the question and build the per-field fetch plans.
+    start, end: pin the time range (cursor pages) instead of resolving it from the text.
+    """
+    with timed("parse_nl_query"):
+        plan = plan_query(query)
+        if start is None or end is None:
+            parsed_start, parsed_end = resolve_time(plan.time_spec)
+            start = start or parsed_start
+            end = end or parsed_end
+
+    fields = list(plan.fields)
+    tags = dict(plan.tags)
+    thresholds = list(plan.thresholds)
+    aggregations = list(plan.aggregations)
+    stats_fields = {f for f in fields if use_stats_plan(SENSOR_CONFIG[f], aggregations, stats_only)}
+
+    return {
+        "query": query,
+        "plan": plan,
+        "start": start,
+        "end": end,
+        "fields": fields,
+        "fleet": plan.fleet,
+        "tags": tags,
+        "thresholds": thresholds,
+        "stats_fields": stats_fields,
+        "plans": {
+            field: plan_field(field, start, end, field in stats_fields, thresholds, aggregations, tags)
+            for field in fields
+        },
+    }
+
+
+def process_field(field, value, prepared: dict):
+    """
+    Turn one field's loaded data into (series, stats, reasoning).
+    value: stats dict for stats-only fields, else a list of Series.
+    Nothing is materialized per point here; see field_points / compact_series.
+    """
+    cfg = SENSOR_CONFIG[field]
+
+    with timed("stats"):
+        if field in prepared["stats_fields"]:
+            # Threshold filter and reductions already ran inside Influx
+            series = []
+            stats = value
+        else:
+            # Columnar filter + stats
+            series = [s.filter(prepared["thresholds"]) for s in value]
+            stats = compute_stats(series, cfg, percentile_names(prepared["plan"].aggregations))
+
+        reasoning = build_reasoning(field, cfg, series, stats, prepared["plans"][field].get("every"))
+
+    return series, stats, reasoning
+
+
+def field_points(field, series, reasoning):
+    """Full-format sample points for one field, each carrying the field's reasoning."""
+    points = series_to_points(series)
+    POINTS_RETURNED.inc(len(points), field=field)
+
+    # ---------------- Inject reasoning into sample points ----------------
+    for p in points:
+        p["reasoning"] = reasoning
+
+    return points
+
+
+# ---------------- Compact format ----------------
+
+def encode_cursor(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        cursor["start"] = datetime.datetime.fromisoformat(cursor["start"])
+        cursor["end"] = datetime.datetime.fromisoformat(cursor["end"])
+        cursor["offset"] = int(cursor["offset"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if cursor["offset"] < 0:
+        raise ValueError("Invalid cursor: negative offset")
+    return cursor
+
+
+def page_cursor(prepared, field, topic, offset):
+    return encode_cursor({
+        "field": field,
+        "topic": topic,
+        "offset": offset,
+        "start": prepared["start"].isoformat(),
+        "end": prepared["end"].isoformat(),
+    })
+
+
+def compact_series(prepared, field, series, max_points=None):
+    """
+    Per-series columnar arrays (epoch-ms "time", "value"). With max_points,
+    longer series are LTTB-downsampled and carry a cursor for paging through
+    the raw points max_points at a time.
+    """
+    out = []
+    for s in series:
+        shown = s.downsample(max_points) if max_points else s
+        POINTS_RETURNED.inc(len(shown), field=field)
+        downsampled = len(shown) < len(s)
+        out.append({
+            "field": field,
+            "topic": s.topic,
+            "count": len(s),
+            "downsampled": downsampled,
+            **shown.to_columns(OFFLINE_THRESHOLD_SECONDS),
+            **({"cursor": page_cursor(prepared, field, s.topic, 0)} if downsampled else {}),
+        })
+    return out
+
+
+async def summarize(
+    series_by_field, field_stats, reasoning_report, defer_summary: bool = False, llm: bool = True, timeout: float = None
+):
+    """
+    Summary text for the whole answer -> (summary, summary_id).
+    Numeric fields are summarized from their stats; only status readings
+    are materialized as points.
+    defer_summary: return the template right away and start the LLM rewrite
+    in the background; summary_id is then set (GET /summary/{summary_id}).
+    llm: False keeps the template (degraded answers, no time left).
+    timeout: time left for the rewrite, on top of SUMMARY_TIMEOUT_SECONDS.
+    """
+    numeric_stats = {field: st for field, st in field_stats.items() if not is_status(SENSOR_CONFIG[field])}
+    status_points = [
+        p
+        for field, series in series_by_field.items() if is_status(SENSOR_CONFIG[field])
+        for p in series_to_points(series)
+    ]
+    summary_id = None
+
+    if defer_summary or not llm:
+        with timed("compute_summary"):
+            summary = summary_template(status_points, reasoning_report=reasoning_report, stats=numeric_stats)
+        if llm and (status_points or numeric_stats):
+            summary_id, _ = start_rewrite(summary)
+    else:
+        summary = await compute_summary(
+            status_points,
+            reasoning_report=reasoning_report,
+            stats=numeric_stats,
+            timeout=SUMMARY_TIMEOUT_SECONDS if timeout is None else min(SUMMARY_TIMEOUT_SECONDS, timeout),
+        )
+
+    for field, text in reasoning_report.items():
+        summary += f"\n{field} reasoning: {text}"
+
+    return summary, summary_id
+
+
+async def run_nl_query(
+    client,
+    query: str,
+    batch: bool = None,
+    stats_only: bool = None,
+    use_cache: bool = None,
+    defer_summary: bool = False,
+    response_format: str = "full",
+    max_points: int = None,
+    prepared: dict = None,
+) -> dict:
+    """
+    Async /nl-query pipeline:
+    parse -> Grafana fetch -> filter/stats/reasoning -> summary.
+    batch: one multi-refId request for all fields (default GRAFANA_BATCH_QUERIES),
+    otherwise one concurrent request per field.
+    stats_only: force (True) or disable (False) the server-side stats plan.
+    use_cache: go through query_cache (default CACHE_ENABLED).
+    defer_summary: return the template summary right away plus a summary_id;
+    the LLM rewrite runs in the background (GET /summary/{summary_id}).
+    response_format: "full" (sample_points dicts) or "compact" (columnar
+    series, reasoning once per field, optional LTTB to max_points).
+    prepared: the question already parsed by prepare_query(query, stats_only).
+    """
+    # ---------------- Parse NL query ----------------
+    if prepared is None:
+        prepared = prepare_query(query, stats_only)
+
+    if batch is None:
+        batch = GRAFANA_BATCH_QUERIES
+
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+
+    if prepared["fleet"]:
+        result = await shared_answer(
+            ("fleet", use_cache, response_format),
+            lambda: answer_fleet_status(client, prepared, use_cache, response_format),
+        )
+        return {**result, "query": query}
+
+    # Identical questions in flight (same plan, not necessarily same wording) share one run
+    key = (plan_key(prepared), batch, use_cache, defer_summary, response_format, max_points)
+    result = await shared_answer(
+        key,
+        lambda: answer_query(client, prepared, batch, use_cache, defer_summary, response_format, max_points),
+    )
+    return {**result, "query": query}
+
+
+async def shared_answer(key, run):
+    """
+    request_flight.run(key, run) within the caller's own deadline. A caller
+    joining an identical run waits for it at most its own fetch budget, and
+    answers by itself (joining whatever fetches are still in flight) if the
+    shared run is not done by then, or came back degraded while this caller
+    still has time left.
+    """
+    fut = request_flight.get(key)
+    if fut is None:
+        return await request_flight.run(key, run)
+
+    request_flight.shared += 1
+    done, _ = await asyncio.wait({fut}, timeout=budget(1 - REQUEST_SUMMARY_SHARE))
+    if not done:
+        return await run()
+    result = fut.result()
+    left = remaining()
+    if "degraded" in result and (left is None or left > 0):
+        return await run()
+    return result
+
+
+def plan_key(prepared: dict) -> tuple:
+    """Normalized, hashable form of a prepared query: what is fetched, how it is filtered and reduced."""
+    return (
+        tuple(
+            (field, plan["kind"], plan["key"], plan["start"], plan["end"])
+            for field, plan in prepared["plans"].items()
+        ),
+        tuple(prepared["thresholds"]),
+        tuple(prepared["plan"].aggregations),
+    )
+
+
+async def answer_query(
+    client,
+    prepared: dict,
+    batch: bool,
+    use_cache: bool,
+    defer_summary: bool,
+    response_format: str = "full",
+    max_points: int = None,
+) -> dict:
+    # ---------------- Fetch all sensors ----------------
+    # Grafana gets the request's budget minus the share kept for the summary
+    loaded = await load_fields(client, prepared["plans"], batch, use_cache, timeout=budget(1 - REQUEST_SUMMARY_SHARE))
+    return await build_answer(prepared, loaded, defer_summary, response_format, max_points)
+
+
+async def build_answer(
+    prepared: dict,
+    loaded: dict,
+    defer_summary: bool,
+    response_format: str = "full",
+    max_points: int = None,
+) -> dict:
+    """
+    The /nl-query answer for a prepared question from its loaded {field: value}.
+    Fields missing from loaded (not fetched before the deadline) are answered
+    as degraded: empty stats, an explanation as reasoning and a "degraded"
+    marker; the summary then stays the template (no LLM rewrite).
+    """
+    series_by_field = {}
+    reasoning_report = {}
+    field_stats = {}
+    missing = [field for field in prepared["fields"] if field not in loaded]
+
+    # ---------------- Process each sensor ----------------
+    for field in prepared["fields"]:
+        if field in missing:
+            reasoning_report[field] = f"No {field} data: the query did not finish within the time budget."
+            continue
+        series_by_field[field], field_stats[field], reasoning_report[field] = process_field(
+            field, loaded[field], prepared
+        )
+
+    # ---------------- Compute summary ----------------
+    summary_budget = budget()
+    llm = not missing and (summary_budget is None or summary_budget > 0)
+    summary, summary_id = await summarize(
+        series_by_field, field_stats, reasoning_report, defer_summary, llm=llm, timeout=summary_budget
+    )
+    for field in missing:
+        series_by_field[field] = []
+        field_stats[field] = dict(EMPTY_STATS)
+
+    result = {
+        "query": prepared["query"],
+        "summary": summary,
+    }
+    if response_format == "compact":
+        result["series"] = [
+            entry
+            for field, series in series_by_field.items()
+            for entry in compact_series(prepared, field, series, max_points)
+        ]
+    else:
+        result["sample_points"] = [
+            p
+            for field, series in series_by_field.items()
+            for p in field_points(field, series, reasoning_report[field])
+        ]
+
+    result["stats"] = {field: field_stats[field] for field in prepared["fields"]}
+    result["reasoning"] = reasoning_report
+    if summary_id:
+        result["summary_id"] = summary_id
+    if not llm:
+        result["degraded"] = {"reason": "deadline", "fields": missing, "summary": "template"}
+        DEGRADED_RESPONSES.inc(reason="deadline")
+    return result
+
+
+# ---------------- Fleet status ----------------
+
+def fleet_points(snapshot: list, reasoning: str) -> list:
+    """Registry snapshot as status sample points (time = last seen)."""
+    return [
+        {
+            "time": last_seen_iso(s["last_seen"]),
+            "value": s["status"],
+            "measurement": "status",
+            "field": "status",
+            "topic": s["topic"],
+            "reasoning": reasoning,
+        }
+        for s in snapshot
+    ]
+
+
+async def answer_fleet_status(client, prepared: dict, use_cache: bool = True, response_format: str = "full") -> dict:
+    """
+    Status of every sensor from fleet_registry, refreshed with one grouped
+    last() query at most every FLEET_STATUS_REFRESH_SECONDS (always when
+    use_cache is off). Only the time of the registry snapshot matters, not
+    the question's time range. If the refresh misses the deadline, the
+    registry as it stands is answered, marked degraded and stale.
+    """
+    stale = False
+    try:
+        await fleet_registry.refresh(client, force=not use_cache)
+    except TimeoutError:
+        if not len(fleet_registry):
+            raise
+        stale = True  # answer from the registry as of its last refresh
+
+    with timed("stats"):
+        snapshot = fleet_registry.snapshot()
+        reasoning = fleet_reasoning(snapshot)
+
+    result = {
+        "query": prepared["query"],
+        "summary": reasoning,
+        "sensors": [{**s, "last_seen": last_seen_iso(s["last_seen"])} for s in snapshot],
+    }
+    if response_format != "compact":
+        result["sample_points"] = fleet_points(snapshot, reasoning)
+        POINTS_RETURNED.inc(len(snapshot), field="status")
+
+    result["stats"] = {"status": fleet_counts(snapshot)}
+    result["reasoning"] = {"status": reasoning}
+    if stale:
+        result["degraded"] = {"reason": "deadline", "fields": ["status"], "stale": True}
+        DEGRADED_RESPONSES.inc(reason="deadline")
+    return result
+
+
+# ---------------- Batch ----------------
+
+def merge_fetch_plans(prepared: dict) -> tuple:
+    """
+    Shared fetch plans for many prepared questions ({index: prepared}).
+    Range plans with the same key whose aligned ranges overlap or touch are
+    fetched once over their union; stats and last plans are shared when key
+    and range are identical.
+    Returns (plans, sources): {name: plan} for load_fields and
+    {(index, field): name} telling where each question's data comes from.
+    """
+    groups = {}
+    for i, p in prepared.items():
+        for field, plan in p["plans"].items():
+            group = plan["key"] if plan["kind"] == "range" else (plan["key"], plan["start"], plan["end"])
+            groups.setdefault(group, []).append((i, field, plan))
+
+    plans = {}
+    sources = {}
+    for members in groups.values():
+        members.sort(key=lambda m: m[2]["start"])
+        runs = []
+        for member in members:
+            plan = member[2]
+            if runs and plan["start"] <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], plan["end"])
+                runs[-1][2].append(member)
+            else:
+                runs.append([plan["start"], plan["end"], [member]])
+
+        for start, end, run in runs:
+            plan = run[0][2]
+            name = f"{plan['field']}@{len(plans)}"
+            if (start, end) != (plan["start"], plan["end"]):
+                plan = {**plan, "start": start, "end": end, "flux": lambda fs, fe=end, flux=plan["flux"]: flux(fs, fe)}
+            plans[name] = plan
+            for i, field, _ in run:
+                sources[(i, field)] = name
+            BATCH_PLANS.inc(result="fetched")
+            BATCH_PLANS.inc(len(run) - 1, result="shared")
+
+    return plans, sources
+
+
+async def run_nl_batch(
+    client,
+    queries: list,
+    batch: bool = None,
+    stats_only: bool = None,
+    use_cache: bool = None,
+    defer_summary: bool = False,
+    response_format: str = "full",
+    max_points: int = None,
+) -> list:
+    """
+    Answer many questions from one shared fetch: every question is planned
+    first, their fetch plans are merged (merge_fetch_plans) and loaded
+    together, then each answer is built from its own slice of the shared
+    data. Options are as for run_nl_query and apply to every question.
+    Returns the /nl-query answers in question order.
+    """
+    if batch is None:
+        batch = GRAFANA_BATCH_QUERIES
+
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+
+    prepared = {i: prepare_query(query, stats_only) for i, query in enumerate(queries)}
+    questions = {i: p for i, p in prepared.items() if not p["fleet"]}
+
+    with timed("batch_plan"):
+        plans, sources = merge_fetch_plans(questions)
+    loaded = await load_fields(client, plans, batch, use_cache, timeout=budget(1 - REQUEST_SUMMARY_SHARE))
+
+    def question_data(i):
+        data = {}
+        for field, plan in questions[i]["plans"].items():
+            if sources[(i, field)] not in loaded:
+                continue  # not fetched in time: build_answer marks it degraded
+            shared = plans[sources[(i, field)]]
+            value = loaded[sources[(i, field)]]
+            if plan["kind"] == "range" and (shared["start"], shared["end"]) != (plan["start"], plan["end"]):
+                value = slice_series(value, plan["start"], plan["end"])
+            data[field] = value
+        return data
+
+    async def answer(i):
+        p = prepared[i]
+        if p["fleet"]:
+            result = await answer_fleet_status(client, p, use_cache, response_format)
+        else:
+            result = await build_answer(p, question_data(i), defer_summary, response_format, max_points)
+        return {**result, "query": queries[i]}
+
+    return list(await asyncio.gather(*(answer(i) for i in prepared)))
+
+
+async def page_nl_query(client, query: str, cursor: str, page_size: int, use_cache: bool = None) -> dict:
+    """
+    Raw points of one series, page by page, in compact columnar form.
+    cursor comes from a downsampled compact series (or a previous page) and
+    pins field, topic, offset and the original time range.
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    c = decode_cursor(cursor)
+    prepared = prepare_query(query, stats_only=False, start=c["start"], end=c["end"])
+    field = c["field"]
+    if field not in prepared["plans"]:
+        raise ValueError(f"Cursor field '{field}' is not part of this query")
+
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+
+    loaded = await load_fields(client, {field: prepared["plans"][field]}, batch=False, use_cache=use_cache)
+    series = [s.filter(prepared["thresholds"]) for s in loaded[field] if s.topic == c["topic"]]
+
+    offset = c["offset"]
+    entries = []
+    for s in series:
+        page = s.take(slice(offset, offset + page_size))
+        POINTS_RETURNED.inc(len(page), field=field)
+        more = offset + page_size < len(s)
+        entries.append({
+            "field": field,
+            "topic": s.topic,
+            "count": len(s),
+            "offset": offset,
+            **page.to_columns(OFFLINE_THRESHOLD_SECONDS),
+            **({"cursor": page_cursor(prepared, field, s.topic, offset + page_size)} if more else {}),
+        })
+
+    return {"query": query, "series": entries}
+
+
+async def stream_nl_query(
+    client,
+    query: str,
+    stats_only: bool = None,
+    use_cache: bool = None,
+    defer_summary: bool = False,
+    chunk_size: int = STREAM_CHUNK_POINTS,
+):
+    """
+    Streaming variant of run_nl_query. Fields are fetched concurrently, one
+    request each, and yielded as soon as their data arrives:
+      {"type": "plan", "query", "fields"}
+      {"type": "field", "field", "stats", "reasoning", "count"}   per field
+      {"type": "points", "field", "points"}                       chunked
+      {"type": "summary", "summary", "reasoning"[, "summary_id"]} last
+    """
+    prepared = prepare_query(query, stats_only)
+    fields = prepared["fields"]
+
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+
+    yield {"type": "plan", "query": query, "fields": fields}
+
+    if prepared["fleet"]:
+        result = await answer_fleet_status(client, prepared, use_cache)
+        points = result["sample_points"]
+        yield {
+            "type": "field",
+            "field": "status",
+            "stats": result["stats"]["status"],
+            "reasoning": result["summary"],
+            "count": len(points),
+        }
+        for i in range(0, len(points), chunk_size):
+            yield {"type": "points", "field": "status", "points": points[i:i + chunk_size]}
+        yield {"type": "summary", "summary": result["summary"], "reasoning": result["reasoning"]}
+        return
+
+    semaphore = asyncio.Semaphore(GRAFANA_MAX_CONCURRENCY)
+    fetch_budget = budget(1 - REQUEST_SUMMARY_SHARE)
+
+    async def load_one(field):
+        loaded = await load_fields(
+            client, {field: prepared["plans"][field]}, batch=False, use_cache=use_cache,
+            semaphore=semaphore, timeout=fetch_budget,
+        )
+        return field, loaded.get(field)
+
+    series_by_field = {}
+    reasoning_report = {}
+    field_stats = {}
+    missing = []
+
+    tasks = [asyncio.ensure_future(load_one(field)) for field in fields]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            field, value = await next_done
+            if value is None:
+                # not fetched within the request deadline, as in build_answer
+                missing.append(field)
+                series_by_field[field], field_stats[field] = [], dict(EMPTY_STATS)
+                reasoning_report[field] = f"No {field} data: the query did not finish within the time budget."
+                yield {
+                    "type": "field",
+                    "field": field,
+                    "stats": field_stats[field],
+                    "reasoning": reasoning_report[field],
+                    "count": 0,
+                    "degraded": True,
+                }
+                continue
+
+            series_by_field[field], field_stats[field], reasoning_report[field] = process_field(
+                field, value, prepared
+            )
+            points = field_points(field, series_by_field[field], reasoning_report[field])
+
+            yield {
+                "type": "field",
+                "field": field,
+                "stats": field_stats[field],
+                "reasoning": reasoning_report[field],
+                "count": len(points),
+            }
+            for i in range(0, len(points), chunk_size):
+                yield {"type": "points", "field": field, "points": points[i:i + chunk_size]}
+    finally:
+        # client went away or a fetch failed: don't leave orphaned Grafana calls
+        for task in tasks:
+            task.cancel()
+
+    # keep the report in the same field order as the non-streaming response
+    reasoning_report = {field: reasoning_report[field] for field in fields}
+    field_stats = {field: field_stats[field] for field in fields}
+    summary_budget = budget()
+    llm = not missing and (summary_budget is None or summary_budget > 0)
+    summary, summary_id = await summarize(
+        series_by_field, field_stats, reasoning_report, defer_summary, llm=llm, timeout=summary_budget
+    )
+    degraded = {}
+    if not llm:
+        degraded = {"degraded": {"reason": "deadline", "fields": missing, "summary": "template"}}
+        DEGRADED_RESPONSES.inc(reason="deadline")
+
+    yield {
+        "type": "summary",
+        "summary": summary,
+        "reasoning": reasoning_report,
+        **({"summary_id": summary_id} if summary_id else {}),
+        **degraded,
+    }
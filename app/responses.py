@@ -0,0 +1,161 @@
+# responses.py
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from app.cache import epoch_seconds
+from app.pipeline import plan_key
+from app.config import (
+    CACHE_TTL_SECONDS,
+    CACHE_CLOSED_TTL_SECONDS,
+    COMPRESS_MIN_BYTES,
+    COMPRESS_THREAD_BYTES,
+    COMPRESS_GZIP_LEVEL,
+    COMPRESS_BROTLI_QUALITY,
+)
+
+try:
+    import orjson
+except ImportError:  # optional: without it bodies are encoded with json.dumps
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+
+# ---------------- JSON ----------------
+
+def dumps(content) -> bytes:
+    """JSON body bytes; orjson (NumPy scalars and arrays included) when installed."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSONResponse rendered with dumps()."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# ---------------- Compression ----------------
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding header -> {coding: q}, e.g. "br;q=1, gzip;q=0.5" -> {"br": 1.0, "gzip": 0.5}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(header: str):
+    """Best of br / gzip the client accepts (highest q, br first on ties), or None for identity."""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    offered = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+async def json_response(request, content, status_code: int = 200, headers: dict = None) -> Response:
+    """
+    FastJSONResponse, compressed with the negotiated encoding once the body
+    reaches COMPRESS_MIN_BYTES (large sample_points answers). Bodies over
+    COMPRESS_THREAD_BYTES are compressed off the event loop.
+    """
+    response = FastJSONResponse(content, status_code=status_code, headers=headers)
+    response.headers["Vary"] = "Accept-Encoding"
+    if len(response.body) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return response
+    if len(response.body) > COMPRESS_THREAD_BYTES:
+        body = await asyncio.to_thread(compress, response.body, encoding)
+    else:
+        body = compress(response.body, encoding)
+
+    response.body = body
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(body))
+    return response
+
+
+# ---------------- HTTP caching ----------------
+
+def answer_validator(prepared: dict, options: tuple, now: float = None):
+    """
+    (ETag, Cache-Control) of an /nl-query answer, known before anything is
+    fetched: a weak ETag over the question, the resolved plan (fields, keys,
+    aligned ranges, thresholds, aggregations), the answer options and a
+    data watermark. A closed range (every plan ends before now) has its end
+    as watermark and is immutable; an open range is valid for the current
+    CACHE_TTL_SECONDS bucket, as long as the query cache would serve it.
+    Status answers (fleet or per-sensor last()) say whether a sensor is
+    online now, whatever the range, so they are not cacheable: (None, "no-store").
+    """
+    if prepared["fleet"] or not prepared["plans"]:
+        return None, "no-store"
+    if any(plan["kind"] == "last" for plan in prepared["plans"].values()):
+        return None, "no-store"
+
+    now = time.time() if now is None else now
+    end = max(epoch_seconds(plan["end"]) for plan in prepared["plans"].values())
+    if end <= now:
+        watermark = ("closed", end)
+        cache_control = f"public, max-age={CACHE_CLOSED_TTL_SECONDS}, immutable"
+    else:
+        bucket = int(now // CACHE_TTL_SECONDS)
+        watermark = ("open", bucket)
+        cache_control = f"public, max-age={max(1, int((bucket + 1) * CACHE_TTL_SECONDS - now))}"
+
+    key = (prepared["query"], plan_key(prepared), tuple(prepared["plan"].aggregations), options, watermark)
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"', cache_control
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check with weak comparison (RFC 9110 13.1.2)."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"})
@@ -0,0 +1,304 @@
+# rollups.py
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from app.flux_builder import build_rollup_flux, split_topics
+from app.data_parser import extract_rollups, merge_stats
+from app.grafana import query_grafana_batch, result_error
+from app.cache import epoch_seconds
+from app.metrics import timed, CACHE_LOOKUPS
+from app.sensor import SENSOR_CONFIG
+from app.series import STATUS_MEASUREMENTS
+from app.topics import topic_registry
+from app.config import (
+    ROLLUP_DB_PATH,
+    ROLLUP_INTERVAL_SECONDS,
+    ROLLUP_BACKFILL_DAYS,
+    ROLLUP_LATE_SECONDS,
+    ROLLUP_BUSY_TIMEOUT_SECONDS,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: msvcrt byte-range lock instead
+    fcntl = None
+    import msvcrt
+
+HOUR = 3600
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    grain INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    mean REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (grain, topic, bucket)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    grain INTEGER PRIMARY KEY,
+    origin INTEGER NOT NULL,
+    until INTEGER NOT NULL
+);
+"""
+
+
+def floor_to(ts: float, step: int) -> int:
+    return int(ts // step * step)
+
+
+def ceil_to(ts: float, step: int) -> int:
+    return -floor_to(-ts, step)
+
+
+def utc(ts: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+
+
+def try_lock(path: str):
+    """Non-blocking exclusive lock on path (created if needed): the open file while held, else None."""
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class RollupStore:
+    """
+    Hourly and daily min/max/mean/count per topic in SQLite, keyed by the
+    bucket's start (epoch s). Hourly rows are materialized from Influx over
+    [origin, until); daily rows are derived from complete days of them.
+    The database is in WAL mode and shared by every worker: lookups go
+    through their own connection and are not blocked by the writer's.
+    """
+
+    def __init__(self, path: str = ROLLUP_DB_PATH):
+        self._conn = self._connect(path)
+        self._writer = self._connect(path)
+        with self._writer:
+            self._writer.executescript(SCHEMA)
+        self._lock = threading.Lock()  # one statement at a time per connection
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=ROLLUP_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def hour_range(self):
+        """(origin, until) of the materialized hourly buckets, or None before the first pass."""
+        with self._lock:
+            row = self._conn.execute("SELECT origin, until FROM watermarks WHERE grain = ?", (HOUR,)).fetchone()
+        return row
+
+    def write_hours(self, rows: dict, origin: int, start: int, end: int):
+        """
+        Upsert hourly rows for buckets in [start, end), rebuild the daily rows
+        of every day that is complete by end and advance the watermark.
+        rows: {(topic, bucket): {"min", "max", "mean", "count"}}
+        """
+        hourly = [
+            (HOUR, topic, bucket, s["min"], s["max"], s["mean"], int(s["count"]))
+            for (topic, bucket), s in rows.items()
+            if start <= bucket < end and s.get("count") and {"min", "max", "mean"} <= s.keys()
+        ]
+        with self._write_lock, self._writer:
+            self._writer.executemany("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)", hourly)
+            self._writer.execute(
+                """
+                INSERT OR REPLACE INTO rollups
+                SELECT ?, topic, bucket - bucket % ?, MIN(min), MAX(max), SUM(mean * count) / SUM(count), SUM(count)
+                FROM rollups
+                WHERE grain = ? AND bucket >= ? AND bucket < ?
+                GROUP BY topic, bucket - bucket % ?
+                """,
+                (DAY, DAY, HOUR, floor_to(start, DAY), floor_to(end, DAY), DAY),
+            )
+            self._writer.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)", (HOUR, origin, end))
+
+    def coverage(self, start: float, end: float):
+        """Largest whole-hour [cs, ce) inside [start, end) that is materialized, or None."""
+        materialized = self.hour_range()
+        if materialized is None:
+            return None
+        origin, until = materialized
+        cs = max(ceil_to(start, HOUR), origin)
+        ce = min(floor_to(end, HOUR), until)
+        return (cs, ce) if cs < ce else None
+
+    def stats(self, topics, start: int, end: int) -> dict:
+        """Merged stats of topics over hour-aligned [start, end): daily rows for whole days, hourly for the rest."""
+        first_day, last_day = ceil_to(start, DAY), floor_to(end, DAY)
+        if first_day < last_day:
+            spans = [(HOUR, start, first_day), (DAY, first_day, last_day), (HOUR, last_day, end)]
+        else:
+            spans = [(HOUR, start, end)]
+
+        topic_set = json.dumps(list(topics))
+        parts = []
+        with self._lock:
+            for grain, s, e in spans:
+                if s >= e:
+                    continue
+                lo, hi, weighted, count = self._conn.execute(
+                    """
+                    SELECT MIN(min), MAX(max), SUM(mean * count), SUM(count)
+                    FROM rollups
+                    WHERE grain = ? AND bucket >= ? AND bucket < ? AND topic IN (SELECT value FROM json_each(?))
+                    """,
+                    (grain, s, e, topic_set),
+                ).fetchone()
+                if count:
+                    parts.append({"min_value": lo, "max_value": hi, "avg_value": weighted / count, "count": count})
+        return merge_stats(*parts)
+
+    def close(self):
+        with self._lock, self._write_lock:
+            self._conn.close()
+            self._writer.close()
+
+
+class RollupMaterializer:
+    """
+    Background job keeping the rollup store current. The first pass backfills
+    ROLLUP_BACKFILL_DAYS; later ones re-read only the last ROLLUP_LATE_SECONDS
+    (late writes) plus whatever hours closed since, one Grafana request per
+    day of hours with one refId per topic chunk.
+
+    Every worker opens the store for lookups, but only the one holding the
+    "<db>.lock" file lock materializes; the others retry the lock each
+    interval and take over if that worker goes away.
+    """
+
+    def __init__(self):
+        self.store = None  # opened by start()
+        self.path = None
+        self.writer_lock = None  # lock file, while this worker is the writer
+        self.task = None
+        self.passes = 0
+
+    @property
+    def is_writer(self) -> bool:
+        return self.writer_lock is not None
+
+    def topics(self) -> tuple:
+        """Topics of every numeric sensor (status last-seen values are not aggregated)."""
+        return tuple(
+            t for field, cfg in SENSOR_CONFIG.items() if cfg["measurement"] not in STATUS_MEASUREMENTS
+            for t in topic_registry.lookup(field)
+        )
+
+    async def refresh(self, client):
+        until = floor_to(time.time(), HOUR)  # closed hours only
+        materialized = await asyncio.to_thread(self.store.hour_range)
+        if materialized is None:
+            origin = start = floor_to(time.time(), DAY) - ROLLUP_BACKFILL_DAYS * DAY
+        else:
+            origin = materialized[0]
+            start = max(origin, floor_to(materialized[1] - ROLLUP_LATE_SECONDS, HOUR))
+
+        chunks = split_topics(self.topics())
+        for day_start in range(start, until, DAY):
+            day_end = min(day_start + DAY, until)
+            fluxes = {
+                f"rollup/{i}": build_rollup_flux(utc(day_start), utc(day_end), chunk)
+                for i, chunk in enumerate(chunks)
+            }
+            resp = await query_grafana_batch(client, fluxes)
+            error = result_error(resp, list(fluxes))
+            if error:
+                raise RuntimeError(error)  # watermark stays put; retried next pass
+
+            rows = extract_rollups(resp, list(fluxes))
+            await asyncio.to_thread(self.store.write_hours, rows, origin, day_start, day_end)
+
+        self.passes += 1
+
+    async def run(self, client):
+        while True:
+            if not self.is_writer:
+                self.writer_lock = try_lock(f"{self.path}.lock")
+                if self.is_writer:
+                    logging.info("Rollup materializer: this worker (pid %d) is the writer", os.getpid())
+            try:
+                if self.is_writer:
+                    await self.refresh(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Rollup refresh failed")
+            await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+    def start(self, client, path: str = ROLLUP_DB_PATH):
+        self.path = path
+        self.store = RollupStore(path)
+        self.task = asyncio.create_task(self.run(client))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.writer_lock is not None:
+            self.writer_lock.close()  # releases the lock
+            self.writer_lock = None
+
+    def lag_seconds(self) -> float:
+        """Seconds between now and the end of the materialized hours (-1 before the first pass)."""
+        materialized = self.store.hour_range() if self.store is not None else None
+        return time.time() - materialized[1] if materialized else -1
+
+    def lookup(self, topics, start: float, end: float):
+        """(cs, ce, stats) of the materialized whole hours in [start, end), or None; blocking."""
+        covered = self.store.coverage(start, end)
+        if covered is None:
+            return None
+        cs, ce = covered
+        return cs, ce, self.store.stats(topics, cs, ce)
+
+    async def cover(self, plan: dict, since):
+        """
+        Rollup answer for the whole-hour middle of a stats plan's [since, end):
+        (cs, ce, stats) with cs / ce as datetimes like since, or None. Only
+        the [since, cs) head and [ce, end) tail then need Grafana. SQLite is
+        read off the event loop.
+        """
+        if self.store is None or not plan.get("rollup"):
+            return None
+
+        with timed("rollup_lookup"):
+            found = await asyncio.to_thread(
+                self.lookup, plan["topics"], epoch_seconds(since), epoch_seconds(plan["end"])
+            )
+            CACHE_LOOKUPS.inc(cache="rollup", result="miss" if found is None else "hit")
+            if found is None:
+                return None
+            cs, ce, stats = found
+
+        tz = since.tzinfo
+        as_since = (lambda ts: utc(ts).replace(tzinfo=None)) if tz is None else (lambda ts: utc(ts).astimezone(tz))
+        return as_since(cs), as_since(ce), stats
+
+
+materializer = RollupMaterializer()
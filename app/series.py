@@ -0,0 +1,186 @@
+# series.py
+import time
+import numpy as np
+from app.stats import StreamingStats
+
+STATUS_MEASUREMENTS = ["status", "sensor_status"]
+
+
+def to_epoch_ms(times) -> np.ndarray:
+    """Grafana time column (epoch ms numbers or ISO strings) -> int64 epoch ms."""
+    try:
+        return np.asarray(times, dtype="int64")
+    except (TypeError, ValueError):
+        parsed = np.array([str(t).replace("Z", "") for t in times], dtype="datetime64[ms]")
+        return parsed.astype("int64")
+
+
+def to_epoch_seconds(ts):
+    """
+    Last-seen timestamps in s, ms or ns (told apart by magnitude) -> epoch
+    seconds. Accepts a scalar or an array; the one unit policy for status.
+    """
+    ts = np.asarray(ts, dtype="float64")
+    seconds = np.where(ts > 1e18, ts / 1e9, np.where(ts > 1e12, ts / 1e3, ts))
+    return seconds if seconds.ndim else float(seconds)
+
+
+def iso_times(times_ms: np.ndarray) -> np.ndarray:
+    """int64 epoch ms -> ISO-8601 UTC strings, e.g. '2026-01-19T08:00:00Z'."""
+    unit = "s" if not np.any(times_ms % 1000) else "ms"
+    return np.char.add(np.datetime_as_string(times_ms.astype("datetime64[ms]"), unit=unit), "Z")
+
+
+class Series:
+    """
+    Columnar view of one Grafana frame: int64 epoch-ms times, float64 values
+    and the topic label. Filtering and stats run vectorized; per-point dicts
+    are only built by to_points() for the slice returned to the client.
+    """
+
+    __slots__ = ("field", "measurement", "topic", "times", "values")
+
+    def __init__(self, field, topic, times, values, measurement=None):
+        self.field = field
+        self.measurement = measurement or field
+        self.topic = topic
+        self.times = times
+        self.values = values
+
+    @classmethod
+    def from_columns(cls, field, topic, times, values):
+        """Build from raw frame columns, dropping null values."""
+        vals = np.asarray(values, dtype="float64")
+        keep = ~np.isnan(vals)
+        times_ms = to_epoch_ms(times)
+        if not keep.all():
+            vals, times_ms = vals[keep], times_ms[keep]
+        return cls(field, topic, times_ms, vals)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def is_status(self):
+        return self.field in STATUS_MEASUREMENTS
+
+    def take(self, mask_or_slice) -> "Series":
+        return Series(self.field, self.topic, self.times[mask_or_slice], self.values[mask_or_slice], self.measurement)
+
+    def between(self, start_ms: int, end_ms: int) -> "Series":
+        """Points with start_ms < time <= end_ms (times are sorted)."""
+        lo = np.searchsorted(self.times, start_ms, side="right")
+        hi = np.searchsorted(self.times, end_ms, side="right")
+        return self.take(slice(lo, hi))
+
+    def filter(self, thresholds) -> "Series":
+        """Keep values matching every ("<" | ">", N) threshold."""
+        if not thresholds or self.is_status:
+            return self
+        mask = np.ones(len(self.values), dtype=bool)
+        for op, threshold in thresholds:
+            if op == "<":
+                mask &= self.values < threshold
+            elif op == ">":
+                mask &= self.values > threshold
+        return self.take(mask)
+
+    def status_labels(self, threshold_seconds: int, now: int = None) -> np.ndarray:
+        """Last-seen timestamps (s, ms or ns) -> ONLINE / OFFLINE."""
+        now = int(time.time()) if now is None else now
+        return np.where(now - to_epoch_seconds(self.values) <= threshold_seconds, "ONLINE", "OFFLINE")
+
+    def downsample(self, max_points: int) -> "Series":
+        """LTTB-downsampled copy with at most max_points points (status series are left as is)."""
+        if self.is_status or len(self) <= max_points:
+            return self
+        return self.take(lttb_indices(self.times, self.values, max_points))
+
+    def to_columns(self, status_threshold: int = None) -> dict:
+        """Columnar arrays for compact responses: epoch-ms times and values."""
+        if self.is_status:
+            values = self.status_labels(status_threshold).tolist()
+        else:
+            values = self.values.tolist()
+        return {"time": self.times.tolist(), "value": values}
+
+    def to_points(self, start: int = 0, stop: int = None, status_threshold: int = None) -> list:
+        """Materialize point dicts for values[start:stop] only."""
+        part = self.take(slice(start, stop))
+        if not len(part):
+            return []
+
+        times = iso_times(part.times).tolist()
+        if self.is_status:
+            values = part.status_labels(status_threshold).tolist()
+            measurement = "status"
+        else:
+            values = part.values.tolist()
+            measurement = self.measurement
+
+        return [
+            {
+                "time": t,
+                "value": v,
+                "measurement": measurement,
+                "field": measurement,
+                "topic": self.topic
+            }
+            for t, v in zip(times, values)
+        ]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    the visual shape of (x, y). First and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    xf = x.astype("float64")
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype="int64")
+    indices[0], indices[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+
+        # average of the next bucket is the third triangle vertex
+        avg_x = xf[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (xf[a] - avg_x) * (y[start:end] - y[a])
+            - (xf[a] - xf[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+
+    return indices
+
+
+def concat_series(head: Series, tail: Series) -> Series:
+    """Append tail's points to head (same field/topic, tail strictly later)."""
+    return Series(
+        head.field,
+        head.topic,
+        np.concatenate([head.times, tail.times]),
+        np.concatenate([head.values, tail.values]),
+        head.measurement,
+    )
+
+
+def series_stats(series_list, percentiles=()) -> dict:
+    """
+    min/max/avg/stddev/count over all values of several series, one series
+    at a time (StreamingStats), plus the requested percentiles ("p95", ...).
+    """
+    acc = StreamingStats(digest=bool(percentiles))
+    for s in series_list:
+        acc.update(s.values)
+    return acc.to_dict(percentiles)
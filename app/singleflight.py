@@ -0,0 +1,48 @@
+# singleflight.py
+import asyncio
+
+
+class SingleFlight:
+    """
+    Collapse concurrent duplicate work: callers asking for the same key while
+    it is in flight await the same future instead of starting their own.
+    Work runs in its own task, so one caller going away never cancels it for
+    the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0  # callers that joined an in-flight call
+
+    def get(self, key):
+        """In-flight future for key, or None."""
+        return self._calls.get(key)
+
+    def share(self, key, fut: asyncio.Future) -> asyncio.Future:
+        """Publish fut under key until it completes."""
+        self._calls[key] = fut
+        fut.add_done_callback(lambda f, key=key: self._forget(key, f))
+        return fut
+
+    def _forget(self, key, fut):
+        if self._calls.get(key) is fut:
+            del self._calls[key]
+        if not fut.cancelled():
+            fut.exception()  # retrieved here so abandoned failures aren't logged as "never retrieved"
+
+    async def run(self, key, fn):
+        """Await fn() - or the identical call already in flight."""
+        fut = self._calls.get(key)
+        if fut is None:
+            fut = self.share(key, asyncio.ensure_future(fn()))
+        else:
+            self.shared += 1
+        return await asyncio.shield(fut)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+# One Grafana fetch per (plan key, range) and one /nl-query run per normalized plan
+fetch_flight = SingleFlight()
+request_flight = SingleFlight()
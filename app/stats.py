@@ -0,0 +1,175 @@
+# stats.py
+import math
+import numpy as np
+from app.config import STATS_TDIGEST_COMPRESSION
+
+EMPTY_STATS = {"min_value": None, "max_value": None, "avg_value": None, "count": 0}
+
+
+def percentile_names(aggregations) -> tuple:
+    """Percentile intents among a question's aggregations, e.g. ("max", "p95") -> ("p95",)."""
+    return tuple(fn for fn in aggregations if fn[0] == "p" and fn[1:].isdigit())
+
+
+class TDigest:
+    """
+    Mergeable approximate quantiles: values are folded into weighted
+    centroids along the k1 (arcsine) scale, which keeps centroids small
+    near the tails. At most ~compression / 2 centroids are kept, however
+    many values went in.
+    """
+
+    __slots__ = ("compression", "means", "weights", "total", "min", "max", "_pending", "_pending_size")
+
+    def __init__(self, compression: float = STATS_TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._pending = []  # (means, weights) not folded in yet
+        self._pending_size = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        if values.size:
+            self._add(values, np.ones(values.size), float(values.min()), float(values.max()))
+
+    def merge(self, other: "TDigest"):
+        other._compress()
+        if other.total:
+            self._add(other.means, other.weights, other.min, other.max)
+
+    def _add(self, means, weights, lo, hi):
+        self._pending.append((means, weights))
+        self._pending_size += means.size
+        self.total += float(weights.sum())
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+        if self._pending_size > 5 * self.compression:
+            self._compress()
+
+    def _compress(self):
+        if not self._pending:
+            return
+        means = np.concatenate([self.means, *(m for m, _ in self._pending)])
+        weights = np.concatenate([self.weights, *(w for _, w in self._pending)])
+        self._pending = []
+        self._pending_size = 0
+
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        q = (np.cumsum(weights) - weights / 2) / self.total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(k)) + 1))
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q: float):
+        """Approximate q-quantile (0..1), interpolated between centroid centres; None when empty."""
+        self._compress()
+        if not self.total:
+            return None
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(
+            q * self.total,
+            np.concatenate(([0.0], centers, [self.total])),
+            np.concatenate(([self.min], self.means, [self.max])),
+        ))
+
+
+class StreamingStats:
+    """
+    One-pass count / min / max / mean / variance: each chunk is reduced
+    once and folded in with Welford's update (Chan's pairwise form), so
+    chunks, parallel sub-queries and cached partial results merge exactly.
+    An optional TDigest adds percentiles. Memory does not depend on how
+    many values went in.
+
+    Partial stats reduced elsewhere (Influx, the rollup store) come in
+    through from_dict() without a digest and usually without variance;
+    those then stay unknown in the merged result rather than being guessed.
+    """
+
+    __slots__ = ("count", "min", "max", "mean", "m2", "digest")
+
+    def __init__(self, digest: bool = True):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean; None once unknown
+        self.digest = TDigest() if digest else None
+
+    @classmethod
+    def from_dict(cls, stats: dict) -> "StreamingStats":
+        """Accumulator holding a {"min_value", "max_value", "avg_value", "count"[, "stddev_value"]} result."""
+        acc = cls(digest=False)
+        if stats and stats.get("count"):
+            n = int(stats["count"])
+            std = stats.get("stddev_value")
+            m2 = std * std * (n - 1) if std is not None else None
+            acc._combine(n, stats["min_value"], stats["max_value"], stats["avg_value"], m2)
+        return acc
+
+    def update(self, values) -> "StreamingStats":
+        """Fold in one chunk of values (any array-like)."""
+        values = np.asarray(values, dtype="float64")
+        if not values.size:
+            return self
+        mean = float(values.mean())
+        m2 = float(np.square(values - mean).sum())
+        self._combine(values.size, float(values.min()), float(values.max()), mean, m2)
+        if self.digest is not None:
+            self.digest.update(values)
+        return self
+
+    def merge(self, other: "StreamingStats") -> "StreamingStats":
+        """Fold in the stats of disjoint data."""
+        if not other.count:
+            return self
+        if self.digest is not None and other.digest is not None:
+            self.digest.merge(other.digest)
+        else:
+            self.digest = None
+        self._combine(other.count, other.min, other.max, other.mean, other.m2)
+        return self
+
+    def _combine(self, n, lo, hi, mean, m2):
+        total = self.count + n
+        delta = mean - self.mean
+        if self.m2 is not None and m2 is not None:
+            self.m2 += m2 + delta * delta * self.count * n / total
+        else:
+            self.m2 = None
+        self.mean += delta * n / total
+        self.count = total
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+
+    @property
+    def variance(self):
+        """Sample variance, None when unknown."""
+        if self.m2 is None:
+            return None
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def quantile(self, q: float):
+        return self.digest.quantile(q) if self.digest is not None and self.count else None
+
+    def to_dict(self, percentiles=()) -> dict:
+        """
+        {"min_value", "max_value", "avg_value", "count"} plus "stddev_value"
+        when known and "<p>_value" for each requested percentile ("p95", ...).
+        """
+        if not self.count:
+            return {**EMPTY_STATS, **{f"{p}_value": None for p in percentiles}}
+
+        stats = {"min_value": self.min, "max_value": self.max, "avg_value": self.mean, "count": int(self.count)}
+        if self.m2 is not None:
+            stats["stddev_value"] = math.sqrt(self.variance)
+        for p in percentiles:
+            stats[f"{p}_value"] = self.quantile(int(p[1:]) / 100)
+        return stats
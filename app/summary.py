@@ -1,6 +1,29 @@
+import asyncio
+import hashlib
+import logging
+import httpx
 from collections import defaultdict
-from app.config import openai_client
 from datetime import datetime
+from app.cache import TTLCache
+from app.singleflight import SingleFlight
+from app.metrics import timed, CACHE_LOOKUPS
+from app.stats import StreamingStats
+from app.config import (
+    OPENAI_API_KEY,
+    SUMMARY_REWRITE_ENABLED,
+    SUMMARY_MODEL,
+    SUMMARY_TIMEOUT_SECONDS,
+    SUMMARY_REWRITE_TIMEOUT_SECONDS,
+    SUMMARY_CACHE_MAX_ENTRIES,
+    SUMMARY_CACHE_TTL_SECONDS,
+)
+
+# Rewritten summaries keyed by summary_key(); shared by all requests
+rewrite_cache = TTLCache(maxsize=SUMMARY_CACHE_MAX_ENTRIES, ttl=SUMMARY_CACHE_TTL_SECONDS)
+rewrite_flight = SingleFlight()  # one LLM call per identical summary text
+
+# Set by the app lifespan (create_openai_client); None means template summaries only
+openai_client = None
 
 def format_time(ts: str) -> str:
     """
@@ -11,13 +34,33 @@ def format_time(ts: str) -> str:
     return dt.strftime("%B %d, %Y at %I:%M %p UTC")
 
 
-def compute_summary(points, reasoning_report=None):
+def append_numeric_summary(summaries, sensor, s, reasoning_report=None):
+    if not s.get("count"):
+        summaries.append(f"No {sensor} readings available or matched the query condition.")
+        return
+
+    percentiles = "".join(
+        f", {key[:-len('_value')]} {value:.2f}"
+        for key, value in s.items() if key.startswith("p") and key.endswith("_value") and value is not None
+    )
+    summaries.append(
+        f"{sensor.capitalize()} → avg {s['avg_value']:.2f}, min {s['min_value']:.2f}, max {s['max_value']:.2f}{percentiles}"
+    )
+
+    # Append reasoning if available
+    if reasoning_report and sensor in reasoning_report:
+        summaries.append(f"{sensor.capitalize()} reasoning: {reasoning_report[sensor]}")
+
+
+def summary_template(points, reasoning_report=None, stats=None):
     """
-    Build a human-readable summary for sensor points.
+    Build the deterministic, human-readable summary for sensor points.
     Optional: append reasoning text per field.
+    Optional: precomputed stats per numeric field; used instead of re-scanning
+    the points, so numeric fields need no points at all.
     Handles numeric sensors, status sensors, and filtered thresholds.
     """
-    if not points:
+    if not points and not stats:
         return "No sensor data available."
 
     grouped = defaultdict(list)
@@ -26,10 +69,12 @@ def compute_summary(points, reasoning_report=None):
 
     summaries = []
 
-    for sensor, vals in grouped.items():
+    # Field order: stats (numeric fields) first, then anything only seen in points
+    for sensor in dict.fromkeys([*(stats or {}), *grouped]):
+        vals = grouped.get(sensor, [])
 
         # ---------------- STATUS SENSOR ----------------
-        if sensor == "status":
+        if sensor == "status" and vals:
             latest = sorted(vals, key=lambda x: x["time"])[-1]
             value = latest["value"]
 
@@ -53,37 +98,111 @@ def compute_summary(points, reasoning_report=None):
 
         # ---------------- NUMERIC SENSORS ----------------
         else:
-            # Keep only numeric values
-            nums = [v['value'] for v in vals if isinstance(v['value'], (int, float))]
-
-            if not nums:
-                summaries.append(f"No {sensor} readings available or matched the query condition.")
-                continue
-
-            avg_val = sum(nums) / len(nums)
-            min_val = min(nums)
-            max_val = max(nums)
-
-            summaries.append(
-                f"{sensor.capitalize()} → avg {avg_val:.2f}, min {min_val:.2f}, max {max_val:.2f}"
-            )
-
-            # Append reasoning if available
-            if reasoning_report and sensor in reasoning_report:
-                summaries.append(f"{sensor.capitalize()} reasoning: {reasoning_report[sensor]}")
-
-    summary_text = " | ".join(summaries)
-
-    # ---------------- OPTIONAL AI REWRITE ----------------
-    if openai_client:
-        try:
-            ai = openai_client.responses.create(
-                model="gpt-4.1-mini",
-                input=f"Rewrite this sensor summary in simple language:\n{summary_text}"
-            )
-            if getattr(ai, "output_text", None):
-                summary_text = ai.output_text.strip()
-        except Exception:
-            pass
-
-    return summary_text
+            s = (stats or {}).get(sensor)
+            if s is None:
+                # Keep only numeric values
+                nums = [v['value'] for v in vals if isinstance(v['value'], (int, float))]
+                s = StreamingStats(digest=False).update(nums).to_dict()
+            append_numeric_summary(summaries, sensor, s, reasoning_report)
+
+    return " | ".join(summaries)
+
+
+# ---------------- OPTIONAL AI REWRITE ----------------
+
+def create_openai_client():
+    """
+    AsyncOpenAI client for summary rewrites, or None when rewrites are off
+    (SUMMARY_REWRITE_ENABLED, OPENAI_API_KEY). The SDK is imported here, not
+    at module import, since it is the slowest import of the app.
+    """
+    if not (SUMMARY_REWRITE_ENABLED and OPENAI_API_KEY):
+        return None
+    try:
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(verify=False, trust_env=False),  # never route through HTTP(S)_PROXY
+        )
+    except Exception as e:
+        logging.warning("OpenAI init failed: %s", e)
+        return None
+
+
+def summary_key(summary_text: str) -> str:
+    """Cache key / summary_id: hash of the model plus the template text."""
+    return hashlib.sha256(f"{SUMMARY_MODEL}\0{summary_text}".encode("utf-8")).hexdigest()
+
+
+async def _rewrite(key: str, summary_text: str):
+    try:
+        ai = await openai_client.responses.create(
+            model=SUMMARY_MODEL,
+            input=f"Rewrite this sensor summary in simple language:\n{summary_text}",
+            timeout=SUMMARY_REWRITE_TIMEOUT_SECONDS,
+        )
+        if getattr(ai, "output_text", None):
+            rewritten = ai.output_text.strip()
+            rewrite_cache.set(key, rewritten)
+            return rewritten
+    except Exception:
+        pass
+    return None
+
+
+def start_rewrite(summary_text: str):
+    """
+    Start (or join) the LLM rewrite of summary_text in the background.
+    Returns (summary_key, task), (summary_key, None) if it is already cached,
+    or (None, None) if no OpenAI client is configured.
+    """
+    if not openai_client:
+        return None, None
+    key = summary_key(summary_text)
+    if rewrite_cache.get(key) is not None:
+        CACHE_LOOKUPS.inc(cache="summary", result="hit")
+        return key, None
+    CACHE_LOOKUPS.inc(cache="summary", result="miss")
+    task = rewrite_flight.get(key)
+    if task is None:
+        task = rewrite_flight.share(key, asyncio.ensure_future(_rewrite(key, summary_text)))
+    else:
+        rewrite_flight.shared += 1
+    return key, task
+
+
+def get_rewrite(key: str):
+    """Finished rewrite for a summary_id: (status, text or None)."""
+    rewritten = rewrite_cache.get(key)
+    if rewritten is not None:
+        return "done", rewritten
+    if rewrite_flight.get(key) is not None:
+        return "pending", None
+    return "unavailable", None
+
+
+async def rewrite_summary(summary_text: str, timeout: float = SUMMARY_TIMEOUT_SECONDS) -> str:
+    """
+    LLM rewrite of the template text, memoized per (model, text).
+    Falls back to the template if the rewrite fails or misses the deadline;
+    a late rewrite keeps running and lands in the cache for the next caller.
+    """
+    key, task = start_rewrite(summary_text)
+    if task is None:
+        return (key and rewrite_cache.get(key)) or summary_text
+
+    try:
+        with timed("openai_rewrite"):
+            rewritten = await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        return summary_text
+    return rewritten or summary_text
+
+
+async def compute_summary(points, reasoning_report=None, stats=None, timeout: float = SUMMARY_TIMEOUT_SECONDS):
+    """Template summary, rewritten by the LLM when available within the deadline."""
+    with timed("compute_summary"):
+        summary_text = summary_template(points, reasoning_report, stats)
+    if not points and not stats:
+        return summary_text
+    return await rewrite_summary(summary_text, timeout)
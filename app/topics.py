@@ -0,0 +1,70 @@
+# topics.py
+import csv
+from collections import defaultdict
+from app.sensor import SENSOR_CONFIG
+from app.config import TOPIC_CATALOG_PATH
+
+# Lookup dimensions besides the sensor type ("from device X", "at site Y", "on line Z")
+TAG_INDEXES = ("device", "site", "line")
+
+
+def path_tags(topic: str) -> dict:
+    """Tags implied by the topic path convention sensors/<device>/<site>/.../<type>."""
+    middle = topic.strip("/").split("/")[1:-1]
+    tags = {}
+    if middle:
+        tags["device"] = middle[0]
+    if len(middle) > 1:
+        tags["site"] = middle[1]
+    return tags
+
+
+class TopicRegistry:
+    """
+    Topic catalogue indexed by sensor type, device, site and line. Lookups
+    intersect the matching index sets (smallest first), so narrowing a
+    question to one device costs O(its topics), not O(catalogue).
+    """
+
+    def __init__(self):
+        self._sensor = defaultdict(dict)  # sensor -> {topic: None}, registration order
+        self._tags = {name: defaultdict(set) for name in TAG_INDEXES}
+        self._seq = {}  # topic -> registration number, keeps lookups in catalogue order
+
+    def register(self, topic: str, sensor: str, **tags):
+        """Add a topic; tags override the ones implied by its path."""
+        self._sensor[sensor][topic] = None
+        self._seq.setdefault(topic, len(self._seq))
+        for name, value in {**path_tags(topic), **tags}.items():
+            if name in self._tags and value:
+                self._tags[name][str(value).lower()].add(topic)
+
+    def lookup(self, sensor: str, **tags) -> tuple:
+        """Topics of a sensor type, narrowed by any device / site / line tags."""
+        topics = self._sensor.get(sensor, {})
+        narrowing = [self._tags[name].get(str(value).lower(), set()) for name, value in tags.items() if name in self._tags]
+        if not narrowing:
+            return tuple(topics)
+
+        narrowing.sort(key=len)
+        keep = [t for t in narrowing[0] if t in topics and all(t in other for other in narrowing[1:])]
+        return tuple(sorted(keep, key=self._seq.get))
+
+    def __len__(self):
+        return sum(len(topics) for topics in self._sensor.values())
+
+
+def load_catalog(registry: TopicRegistry, path: str):
+    """CSV with a header row: topic,sensor[,device][,site][,line]."""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("topic") and row.get("sensor") in SENSOR_CONFIG:
+                registry.register(row["topic"], row["sensor"], **{name: row.get(name) for name in TAG_INDEXES})
+
+
+topic_registry = TopicRegistry()
+for _sensor, _cfg in SENSOR_CONFIG.items():
+    for _topic in _cfg.get("topics", []):
+        topic_registry.register(_topic, _sensor)
+if TOPIC_CATALOG_PATH:
+    load_catalog(topic_registry, TOPIC_CATALOG_PATH)
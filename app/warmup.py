@@ -0,0 +1,86 @@
+# warmup.py
+import asyncio
+import logging
+import time
+from app import summary
+from app.grafana import warm_connections
+from app.config import GRAFANA_MAX_CONNECTIONS, WARMUP_GRAFANA_CONNECTIONS, WARMUP_TIMEOUT_SECONDS
+
+
+class Warmup:
+    """
+    Worker warm-up, started by the app lifespan and run in the background so
+    the worker accepts requests right away: pooled Grafana connections are
+    opened and the OpenAI SDK is imported off the event loop. GET /ready
+    turns 200 once every step has finished; a step that fails or exceeds
+    WARMUP_TIMEOUT_SECONDS is reported but does not hold readiness back.
+    Until the OpenAI step is done, summaries are the template text.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.started = None
+        self.seconds = None  # warm-up duration, once finished
+        self.steps = {}  # step -> "ok" | "skipped" | "failed: ..."
+        self.owns_openai = False
+
+    @property
+    def ready(self) -> bool:
+        return self.seconds is not None
+
+    def start(self, client):
+        self.started = time.perf_counter()
+        self.task = asyncio.create_task(self.run(client))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.owns_openai and summary.openai_client is not None:
+            await summary.openai_client.close()
+            summary.openai_client = None
+        self.owns_openai = False
+
+    async def run(self, client):
+        await asyncio.gather(
+            self.step("grafana", self.warm_grafana(client)),
+            self.step("openai", self.load_openai()),
+        )
+        self.seconds = time.perf_counter() - self.started
+        logging.info("Warm-up finished in %.2fs: %s", self.seconds, self.steps)
+
+    async def step(self, name: str, coro):
+        try:
+            self.steps[name] = await asyncio.wait_for(coro, WARMUP_TIMEOUT_SECONDS)
+        except Exception as e:
+            logging.warning("Warm-up step %s failed: %r", name, e)
+            self.steps[name] = f"failed: {str(e) or type(e).__name__}"
+
+    async def warm_grafana(self, client) -> str:
+        await warm_connections(client, min(WARMUP_GRAFANA_CONNECTIONS, GRAFANA_MAX_CONNECTIONS))
+        return "ok"
+
+    async def load_openai(self) -> str:
+        if summary.openai_client is not None:  # already provided (e.g. a stub)
+            return "ok"
+        client = await asyncio.to_thread(summary.create_openai_client)
+        if client is None:
+            return "skipped"
+        summary.openai_client = client
+        self.owns_openai = True
+        return "ok"
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "warmup_seconds": None if self.seconds is None else round(self.seconds, 3),
+            "steps": dict(self.steps),
+        }
+
+
+# Started and stopped by the app lifespan
+warmup = Warmup()
@@ -0,0 +1,329 @@
+# run.py
+"""
+Benchmark harness for the /nl-query pipeline against local stubs.
+
+    python -m bench.run --points 500 --topics 10 --concurrency 16 --output bench.json
+    python -m bench.run --compare base.json bench.json --tolerance 0.10
+
+Starts the Grafana stub (bench/stub.py) in a subprocess, replaces the OpenAI
+client with StubOpenAI and reports throughput and p50/p95/p99 latency for
+extract_points, the reasoning loop, compute_summary and end-to-end
+/nl-query under concurrent load, plus cold start (import time, and a fresh
+uvicorn worker's time to first response and to /ready), as JSON.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+
+E2E_QUERIES = [
+    "Show temperature humidity and battery level for yesterday",
+    "Average temperature yesterday below 23",
+    "Maximum humidity last 2 days",
+    "light today",
+    "status of sensors",
+]
+REASONING_QUERY = "temperature humidity battery and light last 2 days"
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def summarize_timings(samples: list, wall: float = None) -> dict:
+    """Latency samples (seconds) -> n, throughput and p50/p95/p99/mean in ms."""
+    ms = np.asarray(samples) * 1000
+    wall = wall if wall is not None else float(np.sum(samples))
+    return {
+        "n": len(samples),
+        "throughput_per_s": round(len(samples) / wall, 2) if wall else None,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def timed_calls(fn, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+async def timed_async_calls(fn, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(port: int, points: int, latency_ms: float) -> subprocess.Popen:
+    proc = subprocess.Popen([
+        sys.executable, "-m", "bench.stub",
+        "--port", str(port), "--points", str(points), "--latency-ms", str(latency_ms),
+    ])
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Grafana stub did not start")
+
+
+def wait_for_ok(port: int, path: str, since: float, timeout: float = 30) -> float:
+    """Seconds from `since` (perf_counter) until GET path answers 200."""
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1).status_code == 200:
+                return time.perf_counter() - since
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{path} did not answer 200 within {timeout}s")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+# ---------------- Benchmarks ----------------
+
+def bench_components(args) -> dict:
+    """extract_points, the per-field reasoning loop and compute_summary on synthetic frames."""
+    from bench.stub import FrameGenerator
+    from app.data_parser import extract_points, extract_series
+    from app.pipeline import prepare_query, process_field
+    from app.summary import compute_summary, rewrite_cache
+
+    generator = FrameGenerator(args.points)
+    prepared = prepare_query(REASONING_QUERY, stats_only=False)
+    start_ms = int(prepared["start"].replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    end_ms = start_ms + 2 * 86400 * 1000
+
+    def response(field):
+        topics = prepared["plans"][field]["topics"]
+        frames = [
+            {
+                "schema": {"fields": [{"name": "Time"}, {"name": "Value", "labels": {"topic": t}}]},
+                "data": {"values": list(generator.series(t, start_ms, end_ms))},
+            }
+            for t in topics
+        ]
+        return json.loads(json.dumps({"results": {"A": {"frames": frames}}}))
+
+    responses = {field: response(field) for field in prepared["fields"]}
+    loaded = {field: extract_series(resp, field) for field, resp in responses.items()}
+
+    results = {}
+    results["extract_points"] = summarize_timings(
+        timed_calls(lambda: extract_points(responses["temperature"], "temperature"), args.iterations)
+    )
+
+    def reasoning_loop():
+        for field in prepared["fields"]:
+            process_field(field, loaded[field], prepared)
+
+    results["reasoning_loop"] = summarize_timings(timed_calls(reasoning_loop, args.iterations))
+
+    stats, reasoning = {}, {}
+    for field in prepared["fields"]:
+        _, stats[field], reasoning[field] = process_field(field, loaded[field], prepared)
+
+    async def summary_uncached():
+        rewrite_cache.clear()
+        await compute_summary([], reasoning_report=reasoning, stats=stats)
+
+    async def summary_cached():
+        await compute_summary([], reasoning_report=reasoning, stats=stats)
+
+    results["compute_summary"] = summarize_timings(
+        asyncio.run(timed_async_calls(summary_uncached, max(1, args.iterations // 4)))
+    )
+    results["compute_summary_cached"] = summarize_timings(
+        asyncio.run(timed_async_calls(summary_cached, args.iterations))
+    )
+    return results
+
+
+async def bench_end_to_end(args) -> dict:
+    """Concurrent POST /nl-query through the ASGI app (cache off unless --cache), Grafana stubbed."""
+    import httpx
+    from app.main import app
+
+    samples = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+
+            async def one(i):
+                nonlocal errors
+                body = {"query": E2E_QUERIES[i % len(E2E_QUERIES)], "cache": args.cache}
+                async with semaphore:
+                    t = time.perf_counter()
+                    r = await client.post("/nl-query", json=body)
+                    samples.append(time.perf_counter() - t)
+                    errors += r.status_code != 200
+
+            await one(0)  # warm-up: imports, pools
+            samples.clear()
+            wall = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            wall = time.perf_counter() - wall
+
+    return {"nl_query_e2e": {**summarize_timings(samples, wall), "concurrency": args.concurrency, "errors": errors}}
+
+
+def bench_startup(args, env: dict) -> dict:
+    """
+    Cold start, each run in fresh interpreters: `import app.main`, and a new
+    uvicorn worker from spawn to its first /ping answer and to /ready.
+    """
+    imports, first_response, ready = [], [], []
+    for _ in range(args.startup_runs):
+        out = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], env=env, text=True)
+        imports.append(float(out.strip().splitlines()[-1]))
+
+        port = free_port()
+        since = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            first_response.append(wait_for_ok(port, "/ping", since))
+            ready.append(wait_for_ok(port, "/ready", since))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "startup_import": summarize_timings(imports),
+        "startup_first_response": summarize_timings(first_response),
+        "startup_ready": summarize_timings(ready),
+    }
+
+
+def run(args) -> dict:
+    port = free_port()
+    os.environ.update({
+        "GRAFANA_URL": f"http://127.0.0.1:{port}",
+        "GRAFANA_API_KEY": "bench",
+        "ROLLUP_ENABLED": "false",
+    })
+    os.environ.pop("OPENAI_API_KEY", None)
+
+    stub = start_stub(port, args.points, args.latency_ms)
+    try:
+        from bench.stub import StubOpenAI
+        from app import summary
+        from app.topics import topic_registry
+        from app.sensor import SENSOR_CONFIG
+
+        summary.openai_client = StubOpenAI(args.llm_latency_ms / 1000)
+        for field, cfg in SENSOR_CONFIG.items():
+            if cfg["measurement"] != "status":
+                for i in range(1, args.topics):
+                    topic_registry.register(f"sensors/bench{i}/line/{field}", field)
+
+        results = bench_components(args)
+        results.update(asyncio.run(bench_end_to_end(args)))
+        if args.startup_runs:
+            # With an API key set, /ready includes loading the OpenAI SDK (no OpenAI call is made)
+            results.update(bench_startup(args, {**os.environ, "OPENAI_API_KEY": "bench"}))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+        },
+        "results": results,
+    }
+
+
+# ---------------- Comparison ----------------
+
+def compare(base: dict, new: dict, tolerance: float) -> list:
+    """Rows of (benchmark, metric, base, new, change, regressed) for results in both runs."""
+    rows = []
+    for name, b in base["results"].items():
+        n = new["results"].get(name)
+        if n is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+            if not b.get(metric) or n.get(metric) is None:
+                continue
+            change = (n[metric] - b[metric]) / b[metric]
+            worse = -change if metric == "throughput_per_s" else change
+            rows.append((name, metric, b[metric], n[metric], change, metric in ("p95_ms", "throughput_per_s") and worse > tolerance))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=500, help="points per topic per Grafana query")
+    parser.add_argument("--topics", type=int, default=1, help="topics per numeric sensor")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Grafana stub latency")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="OpenAI stub latency")
+    parser.add_argument("--iterations", type=int, default=200, help="iterations per component benchmark")
+    parser.add_argument("--requests", type=int, default=400, help="end-to-end /nl-query requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--startup-runs", type=int, default=5, help="cold starts measured (0 skips them)")
+    parser.add_argument("--cache", action="store_true", help="let /nl-query use its caches")
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p95 / throughput regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        rows = compare(base, new, args.tolerance)
+        for name, metric, b, n, change, regressed in rows:
+            print(f"{name:24} {metric:17} {b:>10} -> {n:>10}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# stub.py
+"""
+Local stand-ins for Grafana's /api/ds/query and the OpenAI client.
+
+Run the Grafana stub on its own (the benchmark starts it as a subprocess):
+    python -m bench.stub --port 3999 --points 500 --latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+import zlib
+import numpy as np
+
+REGEX_RE = re.compile(r"r\.topic =~ /\^\(\?:(.*?)\)\$/")
+EQ_RE = re.compile(r'r\.topic == ("(?:[^"\\]|\\.)*")')
+RANGE_RE = re.compile(r'range\(start: time\(v: "([^"]+)"\), stop: time\(v: "([^"]+)"\)\)')
+
+
+def flux_epoch_ms(ts: str) -> int:
+    return int(np.datetime64(ts.replace("Z", ""), "ms").astype("int64"))
+
+
+def parse_flux(flux: str):
+    """Topics and [start, stop) epoch-ms range a Flux query asks for."""
+    m = REGEX_RE.search(flux)
+    if m:
+        topics = [re.sub(r"\\(.)", r"\1", t) for t in re.split(r"(?<!\\)\|", m.group(1))]
+    else:
+        topics = [json.loads(t) for t in EQ_RE.findall(flux)]
+    r = RANGE_RE.search(flux)
+    start, stop = (flux_epoch_ms(r.group(1)), flux_epoch_ms(r.group(2))) if r else (0, 0)
+    return topics, start, min(stop, int(time.time() * 1000))
+
+
+def frame(times, values, labels: dict, extra_fields=()) -> dict:
+    """One data frame in Grafana's schema.fields / data.values shape."""
+    fields = [{"name": name} for name, _ in extra_fields]
+    fields += [{"name": "Time", "type": "time"}, {"name": "Value", "type": "number", "labels": labels}]
+    return {
+        "schema": {"fields": fields},
+        "data": {"values": [list(col) for _, col in extra_fields] + [list(times), list(values)]},
+    }
+
+
+class FrameGenerator:
+    """
+    Deterministic synthetic sensor data: `points` readings per topic spread
+    over the requested range, a seeded random walk per topic.
+    """
+
+    def __init__(self, points: int = 500):
+        self.points = points
+
+    def series(self, topic: str, start: int, stop: int):
+        n = self.points if stop > start else 0
+        times = np.linspace(start, stop, n, endpoint=False, dtype="int64") if n else np.empty(0, dtype="int64")
+        rng = np.random.default_rng(zlib.crc32(topic.encode()))
+        values = np.round(22 + np.cumsum(rng.normal(0, 0.2, n)), 3)
+        return times.tolist(), values.tolist()
+
+    def result(self, flux: str) -> dict:
+        topics, start, stop = parse_flux(flux)
+        now = time.time()
+        frames = []
+
+        if "|> group()" in flux:  # fleet status: one topic/_time/_value table
+            frames.append(frame(
+                [int(now * 1000)] * len(topics), [now] * len(topics), {},
+                extra_fields=[("topic", topics)],
+            ))
+        elif "last()" in flux:  # single-topic status: last-seen seconds
+            frames += [frame([int(now * 1000)], [now], {"topic": t}) for t in topics]
+        elif "union(tables" in flux:  # stats (and rollup windows): one scalar per (topic, stat)
+            for t in topics:
+                _, values = self.series(t, start, stop)
+                if not values:
+                    continue
+                v = np.asarray(values)
+                for stat, value in (("min", v.min()), ("max", v.max()), ("mean", v.mean()), ("count", v.size)):
+                    frames.append(frame([start], [float(value)], {"topic": t, "stat": stat}))
+        else:
+            frames += [frame(*self.series(t, start, stop), {"topic": t}) for t in topics]
+
+        return {"status": 200, "frames": frames}
+
+    def response(self, body: dict) -> dict:
+        return {"results": {q["refId"]: self.result(q["query"]) for q in body.get("queries", [])}}
+
+
+def create_stub_app(generator: FrameGenerator, latency: float = 0.0):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import Response
+
+    app = FastAPI()
+
+    @app.post("/api/ds/query")
+    async def ds_query(request: Request):
+        body = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        return Response(json.dumps(generator.response(body)).encode(), media_type="application/json")
+
+    @app.get("/ping")
+    def ping():
+        return {"status": "ok"}
+
+    return app
+
+
+# ---------------- OpenAI ----------------
+
+class _Completion:
+    def __init__(self, text):
+        self.output_text = text
+
+
+class _Responses:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, model: str, input: str, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return _Completion(input.split("\n", 1)[-1])
+
+
+class StubOpenAI:
+    """Just enough of AsyncOpenAI for summary rewrites: responses.create() after a fixed latency."""
+
+    def __init__(self, latency: float = 0.05):
+        self.responses = _Responses(latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grafana /api/ds/query stub")
+    parser.add_argument("--port", type=int, default=3999)
+    parser.add_argument("--points", type=int, default=500, help="points per topic per query")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_stub_app(FrameGenerator(args.points), args.latency_ms / 1000)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import datetime
+import numpy as np
+from app.cache import QueryCache
+from app.series import Series
+
+HOUR = datetime.timedelta(hours=1)
+STEP = datetime.timedelta(minutes=5)
+KEY = ("series", ("sensors/a/temperature",), "temperature", "5m", "mean")
+
+
+def open_end():
+    """An aligned end two hours ahead, so that end - 1h is still an open (sliding) range."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0) + 2 * HOUR
+
+
+def series(start, end, topic="sensors/a/temperature", base=20.0):
+    """Points every 5 minutes in (start, end]."""
+    times = np.arange(int((start + STEP).timestamp() * 1000), int(end.timestamp() * 1000) + 1, int(STEP.total_seconds() * 1000))
+    return [Series("temperature", topic, times, base + np.arange(len(times), dtype="float64"))]
+
+
+def first_time(result):
+    return datetime.datetime.fromtimestamp(result[0].times[0] / 1000, datetime.timezone.utc)
+
+
+def test_sliding_range_hit_while_fresh():
+    cache = QueryCache()
+    end = open_end()
+    cache.store_range(KEY, end - 10 * HOUR, end, series(end - 10 * HOUR, end))
+
+    state, value = cache.lookup_range(KEY, end - 4 * HOUR, end, overlap=STEP)
+    assert state == "hit"
+    assert first_time(value) == end - 4 * HOUR + STEP
+    assert len(value[0]) == 48
+
+
+def test_sliding_range_miss_before_cached_start():
+    cache = QueryCache()
+    end = open_end()
+    cache.store_range(KEY, end - 10 * HOUR, end, series(end - 10 * HOUR, end))
+
+    assert cache.lookup_range(KEY, end - 11 * HOUR, end, overlap=STEP) == ("miss", None)
+
+
+def test_moved_range_fetches_only_the_tail():
+    cache = QueryCache()
+    end = open_end()
+    cache.store_range(KEY, end - 11 * HOUR, end - HOUR, series(end - 11 * HOUR, end - HOUR))
+
+    state, (since, head) = cache.lookup_range(KEY, end - 10 * HOUR, end, overlap=STEP)
+    assert state == "tail"
+    assert since == end - HOUR - STEP  # the last, still filling bucket is re-read
+    assert first_time(head) == end - 10 * HOUR + STEP
+    assert head[0].times[-1] == int(since.timestamp() * 1000)
+
+
+def test_extend_range_merges_trims_and_stores():
+    cache = QueryCache()
+    end = open_end()
+    start = end - 10 * HOUR
+    cache.store_range(KEY, end - 11 * HOUR, end - HOUR, series(end - 11 * HOUR, end - HOUR))
+    _, tail = cache.lookup_range(KEY, start, end, overlap=STEP)
+
+    merged = cache.extend_range(KEY, start, end, tail, series(tail[0], end, base=50.0))
+    assert first_time(merged) == start + STEP
+    assert len(merged[0]) == 120
+    assert np.all(np.diff(merged[0].times) > 0)
+    assert cache.tail_fetches == 1
+
+    state, value = cache.lookup_range(KEY, start, end, overlap=STEP)
+    assert state == "hit"
+    assert np.array_equal(value[0].times, merged[0].times)
+
+
+def test_extend_range_keeps_its_own_head_when_the_entry_is_narrowed():
+    cache = QueryCache()
+    end = open_end()
+    cache.store_range(KEY, end - 41 * HOUR, end - HOUR, series(end - 41 * HOUR, end - HOUR))
+    _, tail40 = cache.lookup_range(KEY, end - 40 * HOUR, end, overlap=STEP)
+    _, tail30 = cache.lookup_range(KEY, end - 30 * HOUR, end, overlap=STEP)
+
+    # the shorter request finishes first and replaces the sliding entry
+    cache.extend_range(KEY, end - 30 * HOUR, end, tail30, series(tail30[0], end))
+    merged = cache.extend_range(KEY, end - 40 * HOUR, end, tail40, series(tail40[0], end))
+    assert first_time(merged) == end - 40 * HOUR + STEP
+    assert len(merged[0]) == 480
+
+
+def test_extend_range_keeps_topics_missing_from_the_tail():
+    cache = QueryCache()
+    end = open_end()
+    start = end - 10 * HOUR
+    head = series(end - 11 * HOUR, end - HOUR) + series(end - 11 * HOUR, end - HOUR, topic="sensors/b/temperature")
+    cache.store_range(KEY, end - 11 * HOUR, end - HOUR, head)
+    _, tail = cache.lookup_range(KEY, start, end, overlap=STEP)
+
+    merged = cache.extend_range(KEY, start, end, tail, series(tail[0], end))
+    assert sorted(s.topic for s in merged) == ["sensors/a/temperature", "sensors/b/temperature"]
+
+
+def test_closed_range_has_its_own_entry():
+    cache = QueryCache()
+    end = open_end() - 48 * HOUR
+    start = end - 24 * HOUR
+    cache.store_range(KEY, start, end, series(start, end))
+
+    assert cache.lookup_range(KEY, start, end, overlap=STEP)[0] == "hit"
+    assert cache.entries.get(KEY) is None  # the sliding entry is untouched
+    assert cache.lookup_range(KEY, start + HOUR, end, overlap=STEP) == ("miss", None)
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import json
+import httpx
+import numpy as np
+import pytest
+from app.cache import query_cache
+from app.pipeline import flight_key, load_fields
+from app.series import Series
+from app.singleflight import fetch_flight
+
+HOUR = datetime.timedelta(hours=1)
+STEP = datetime.timedelta(minutes=5)
+TOPIC = "sensors/a/temperature"
+KEY = ("series", (TOPIC,), "temperature", "5m", "mean")
+
+
+def open_end():
+    return datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0) + 2 * HOUR
+
+
+def range_plan(start, end):
+    return {
+        "kind": "range",
+        "field": "temperature",
+        "topics": (TOPIC,),
+        "key": KEY,
+        "start": start,
+        "end": end,
+        "bucket": STEP,
+        "flux": lambda fs, fe=end: [json.dumps([fs.timestamp(), fe.timestamp()])],
+    }
+
+
+def points(since_s, end_s):
+    step = int(STEP.total_seconds() * 1000)
+    return list(range(int(since_s * 1000) + step, int(end_s * 1000) + 1, step))
+
+
+def grafana(calls):
+    """Mock /api/ds/query: every query is a JSON [since, end] pair, answered with one reading per 5 minutes."""
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        results = {}
+        for q in json.loads(request.content)["queries"]:
+            times = points(*json.loads(q["query"]))
+            results[q["refId"]] = {"frames": [{
+                "schema": {"fields": [{"name": "Time"}, {"name": "Value", "labels": {"topic": TOPIC}}]},
+                "data": {"values": [times, [20.0] * len(times)]},
+            }]}
+        return httpx.Response(200, json={"results": results})
+
+    return httpx.AsyncClient(base_url="https://grafana", transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    query_cache.entries.clear()
+    yield
+    query_cache.entries.clear()
+
+
+def first_time(loaded):
+    return datetime.datetime.fromtimestamp(loaded["temperature"][0].times[0] / 1000, datetime.timezone.utc)
+
+
+def test_flight_key_includes_start_since_end_and_cache_mode():
+    end = open_end()
+    since = end - 2 * HOUR
+    plan30, plan40 = range_plan(end - 30 * HOUR, end), range_plan(end - 40 * HOUR, end)
+
+    assert flight_key(plan30, since, True) == flight_key(range_plan(end - 30 * HOUR, end), since, True)
+    assert flight_key(plan30, since, True) != flight_key(plan40, since, True)
+    assert flight_key(plan30, since, True) != flight_key(plan30, since - HOUR, True)
+    assert flight_key(plan30, since, True) != flight_key(range_plan(end - 30 * HOUR, end + HOUR), since, True)
+    assert flight_key(plan30, since, True) != flight_key(plan30, since, False)
+
+
+def test_identical_fetches_are_joined():
+    end = open_end()
+    calls = []
+
+    async def run():
+        client = grafana(calls)
+        plan = range_plan(end - 30 * HOUR, end)
+        return await asyncio.gather(*(load_fields(client, {"temperature": plan}, batch=True) for _ in range(2)))
+
+    a, b = asyncio.run(run())
+    assert len(calls) == 1
+    assert np.array_equal(a["temperature"][0].times, b["temperature"][0].times)
+    assert len(fetch_flight) == 0
+
+
+def test_longer_range_does_not_join_a_shorter_tail_fetch():
+    end = open_end()
+    head_start, head_end = end - 41 * HOUR, end - HOUR
+    times = np.array(points(head_start.timestamp(), head_end.timestamp()), dtype="int64")
+    query_cache.store_range(KEY, head_start, head_end, [Series("temperature", TOPIC, times, np.full(len(times), 20.0))])
+    calls = []
+
+    async def run():
+        client = grafana(calls)
+        return await asyncio.gather(
+            load_fields(client, {"temperature": range_plan(end - 30 * HOUR, end)}, batch=True),
+            load_fields(client, {"temperature": range_plan(end - 40 * HOUR, end)}, batch=True),
+        )
+
+    loaded30, loaded40 = asyncio.run(run())
+    assert len(calls) == 2  # same since and end, different start: fetched separately
+    assert first_time(loaded30) == end - 30 * HOUR + STEP
+    assert first_time(loaded40) == end - 40 * HOUR + STEP
+    assert len(loaded40["temperature"][0]) == 480